@@ -4,41 +4,339 @@
 
 from .config import *
 
+import os
+import json
+import hashlib
+import math
 import pymysql
 import pandas as pd
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import box
 from pymysql.constants import CLIENT
-import urllib.request
+import queue
+import shutil
+import tempfile
+import threading
+import weakref
 import zipfile
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import osmnx as ox
 
+# serve repeated Overpass queries for the same bbox and tags from disk
+ox.settings.use_cache = True
+ox.settings.cache_folder = "./cache"
+# grid, in degrees, that POI bboxes are snapped to before querying Overpass
+POI_BBOX_QUANTUM = 0.01
+# columns kept from the POIs returned by Overpass, besides the requested tags
+POI_COLUMNS = ["name", "addr:city", "addr:postcode", "addr:street", "geometry"]
 
-def create_connection(user, password, host, database, port=3306):
+
+try:
+    import mariadb
+except ImportError:
+    mariadb = None
+
+
+# idle connections keyed by (driver, user, host, port, database, compress),
+# reused last-in first-out so the most recently used session is handed out again
+_connection_pools = {}
+# pool key of each connection handed out, held weakly so connections that are
+# dropped without close_connection can still be garbage collected
+_connection_keys = weakref.WeakKeyDictionary()
+_connection_pools_lock = threading.Lock()
+MAX_IDLE_CONNECTIONS = 16
+
+
+def create_connection(
+    user, password, host, database, port=3306, driver="pymysql", compress=False
+):
     """Create a database connection to the MariaDB database
-        specified by the host url and database name.
+        specified by the host url and database name. An idle connection
+        released by `close_connection` is reused when one is available.
+        With driver="mariadb" the native MariaDB Connector/Python is used,
+        which decodes results in C; it does not accept several statements
+        in one execute, so schema set-up should still use pymysql.
+        compress=True turns on protocol compression, which cuts the bytes sent
+        by bulk loads such as `PostcodeData.load_postcode_data` over a remote
+        link; it is only supported by the mariadb driver.
     :param user: username
     :param password: password
     :param host: host url
     :param database: database
     :param port: port number
+    :param driver: "pymysql" or "mariadb"
+    :param compress: whether to compress the client/server protocol
     :return: Connection object or None
     """
+    if driver not in ("pymysql", "mariadb"):
+        raise ValueError(f"Unknown database driver: {driver}")
+    if driver == "mariadb" and mariadb is None:
+        raise ImportError("driver='mariadb' requires the mariadb package")
+    if compress and driver != "mariadb":
+        raise ValueError("compress=True requires driver='mariadb'")
+
+    key = (driver, user, host, port, database, compress)
+    while True:
+        with _connection_pools_lock:
+            idle = _connection_pools.get(key)
+            if not idle:
+                break
+            conn = idle.pop()
+        try:
+            conn.ping()
+            return conn
+        except Exception:
+            _connection_keys.pop(conn, None)
+
     conn = None
     try:
-        conn = pymysql.connect(
-            user=user,
-            passwd=password,
-            host=host,
-            port=port,
-            local_infile=1,
-            db=database,
-            client_flag=CLIENT.MULTI_STATEMENTS,
-        )
+        if driver == "mariadb":
+            conn = mariadb.connect(
+                user=user,
+                password=password,
+                host=host,
+                port=port,
+                database=database,
+                local_infile=True,
+                compress=compress,
+            )
+        else:
+            conn = pymysql.connect(
+                user=user,
+                passwd=password,
+                host=host,
+                port=port,
+                local_infile=1,
+                db=database,
+                client_flag=CLIENT.MULTI_STATEMENTS,
+            )
+        _connection_keys[conn] = key
     except Exception as e:
         print(f"Error connecting to the MariaDB Server: {e}")
     return conn
 
 
+def close_connection(conn):
+    """Release a connection obtained from `create_connection` back to the pool,
+    closing it instead if the pool for its database is already full
+    :param conn: a connection to the database
+    :return: None
+    """
+    key = _connection_keys.get(conn)
+    if key is not None:
+        with _connection_pools_lock:
+            idle = _connection_pools.setdefault(key, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append(conn)
+                return
+    _connection_keys.pop(conn, None)
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def format_index_columns(column_name):
+    """Format one column name, or a sequence of them, as an index column list
+    :param column_name: a column name or a sequence of column names
+    :return: a string of comma-separated quoted column names
+    """
+    if isinstance(column_name, str):
+        return column_name
+    return ", ".join(f"`{name}`" for name in column_name)
+
+
+def get_pp_data_file_names(year):
+    """Get the names of the pp_data CSV files published for a given year
+    :param year: year
+    :return: a list of file names
+    """
+    if year == 2022:
+        return ["pp-2022.csv"]
+    return [
+        "pp-" + str(year) + "-" + "part" + str(part) + ".csv" for part in range(1, 3)
+    ]
+
+
+def get_pp_data_partition_name(year):
+    """Get the name of the pp_data partition holding transfers from a given year
+    :param year: year
+    :return: the partition name
+    """
+    return f"p{year}"
+
+
+def create_http_session(pool_maxsize=16):
+    """Create a requests session with a keep-alive connection pool of
+    pool_maxsize connections per host, retrying failed requests with backoff
+    :param pool_maxsize: number of pooled connections per host
+    :return: a requests session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=3, backoff_factor=1),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_local_copy_current(session, url, file_name):
+    """Check with a HEAD request whether the local file has the size the server
+    reports and is newer than the server copy
+    :param session: a requests session
+    :param url: url of the file
+    :param file_name: local file name
+    :return: True if the local file can be kept
+    """
+    r = session.head(url)
+    if not r.ok or "Content-Length" not in r.headers:
+        return False
+    if int(r.headers["Content-Length"]) != os.path.getsize(file_name):
+        return False
+    if "Last-Modified" in r.headers:
+        last_modified = parsedate_to_datetime(r.headers["Last-Modified"])
+        return os.path.getmtime(file_name) >= last_modified.timestamp()
+    return True
+
+
+def download_to_part_file(session, url, part_name, headers, chunk_size=1 << 20):
+    """Stream the file at url into part_name, resuming with a ranged request when
+    a partial download and the validators it was started with, recorded in
+    `<part_name>.json`, are present. If-Range makes the server send the whole
+    file instead if it has changed since.
+    :param session: a requests session
+    :param url: url of the file
+    :param part_name: local name of the partial file
+    :param headers: extra headers sent when the download is not resumed
+    :param chunk_size: number of bytes written per chunk
+    :return: False if the server answered 304 Not Modified, True otherwise
+    """
+    validators_name = part_name + ".json"
+    if os.path.exists(part_name) and os.path.exists(validators_name):
+        with open(validators_name) as sidecar:
+            validators = json.load(sidecar)
+        validator = validators.get("ETag", validators.get("Last-Modified"))
+        if validator is not None:
+            headers = {
+                "Range": f"bytes={os.path.getsize(part_name)}-",
+                "If-Range": validator,
+            }
+
+    with session.get(url, stream=True, headers=headers) as r:
+        if r.status_code == 304:
+            return False
+        if r.status_code == 416:
+            # the partial file already holds the whole body
+            return True
+        r.raise_for_status()
+        if r.status_code != 206:
+            validators = {
+                key: r.headers[key]
+                for key in ("ETag", "Last-Modified")
+                if key in r.headers
+            }
+            with open(validators_name, "w") as sidecar:
+                json.dump(validators, sidecar)
+        with open(part_name, "ab" if r.status_code == 206 else "wb") as outfile:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                outfile.write(chunk)
+    return True
+
+
+def download_file(session, url, file_name, chunk_size=1 << 20, max_attempts=3):
+    """Stream the file at url to disk in chunks of chunk_size bytes. The ETag and
+    Last-Modified headers of the response are recorded in `<file_name>.json`,
+    and later calls send them back so an unchanged file is not transferred again.
+    The body is written to `<file_name>.part` and renamed once complete; an
+    interrupted transfer is resumed from where it stopped, here or on a later call.
+    :param session: a requests session
+    :param url: url of the file
+    :param file_name: local file name
+    :param chunk_size: number of bytes written per chunk
+    :param max_attempts: number of times a dropped transfer is resumed
+    :return: True if the file was downloaded, False if the local copy was current
+    """
+    sidecar_name = file_name + ".json"
+    part_name = file_name + ".part"
+    headers = {}
+    if os.path.exists(file_name) and not os.path.exists(part_name):
+        if os.path.exists(sidecar_name):
+            with open(sidecar_name) as sidecar:
+                validators = json.load(sidecar)
+            if "ETag" in validators:
+                headers["If-None-Match"] = validators["ETag"]
+            if "Last-Modified" in validators:
+                headers["If-Modified-Since"] = validators["Last-Modified"]
+        elif is_local_copy_current(session, url, file_name):
+            return False
+
+    for attempt in range(max_attempts):
+        try:
+            if not download_to_part_file(session, url, part_name, headers, chunk_size):
+                return False
+            break
+        except (
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.ConnectionError,
+        ) as e:
+            if attempt == max_attempts - 1:
+                raise
+            print(f"Resuming {file_name} after an interrupted transfer: {e}")
+
+    os.replace(part_name, file_name)
+    os.replace(part_name + ".json", sidecar_name)
+    return True
+
+
+def read_sql_in_chunks(conn, sql_query, args=None, chunksize=100000):
+    """Run sql_query on an unbuffered server-side cursor and build the result
+    dataframe chunk by chunk, so rows are not all buffered by the driver first
+    :param conn: a connection to the database
+    :param sql_query: the query to run, with %s placeholders for args
+    :param args: a sequence of parameters bound to the query
+    :param chunksize: number of rows fetched per chunk
+    :return: a dataframe containing the query results
+    """
+    if isinstance(conn, pymysql.connections.Connection):
+        cur = conn.cursor(pymysql.cursors.SSCursor)
+    else:
+        # MariaDB Connector/Python cursors buffer the whole result by default
+        cur = conn.cursor(buffered=False)
+    try:
+        cur.execute(sql_query, args)
+        columns = [desc[0] for desc in cur.description]
+        chunks = []
+        rows = cur.fetchmany(chunksize)
+        while rows:
+            chunks.append(pd.DataFrame.from_records(rows, columns=columns))
+            rows = cur.fetchmany(chunksize)
+    finally:
+        cur.close()
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _drain_results(cur):
+    """Read through the results of every statement of a multi-statement execute,
+    which raises the error of a failed statement after the first one and leaves
+    the connection ready for the next command
+    :param cur: the cursor the statements were executed on
+    :return: None
+    """
+    while cur.nextset():
+        pass
+
+
 def initialize_database(conn, db_name):
     """Initialize database specified by db_name, set SQL_MODE and timezone
     :param db_name: database name
@@ -52,7 +350,7 @@ def initialize_database(conn, db_name):
         CREATE DATABASE IF NOT EXISTS `{db_name}` DEFAULT CHARACTER SET utf8 COLLATE utf8_bin;
     """
     )
-    conn.commit()
+    _drain_results(cur)
     print(f"Database {db_name} initialized")
 
 
@@ -71,26 +369,72 @@ class DatabaseTable:
         cur.execute(
             f"""
             ALTER TABLE `{self.table_name}`
-            ADD PRIMARY KEY (`{column_name}`);
-            ALTER TABLE `{self.table_name}`
-            MODIFY `{column_name}` bigint(20) unsigned NOT NULL AUTO_INCREMENT,AUTO_INCREMENT=1;
+            ADD PRIMARY KEY (`{column_name}`),
+            MODIFY `{column_name}` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+            AUTO_INCREMENT=1;
         """
         )
-        self.conn.commit()
         print(f"Added primary key {column_name} for table {self.table_name}")
 
     def create_index(self, index_name, column_name):
+        """Create a B-tree index on one column, or on several columns when
+        `column_name` is a tuple or list of names
+        :param index_name: index name
+        :param column_name: a column name or a sequence of column names
+        :return: None
+        """
+        columns = format_index_columns(column_name)
         cur = self.conn.cursor()
         cur.execute(
             f"""
-            CREATE INDEX `{index_name}` USING HASH
+            CREATE INDEX `{index_name}`
             ON `{self.table_name}`
-            ({column_name});
+            ({columns});
         """
         )
-        self.conn.commit()
         print(
-            f"Index {index_name} created on column {column_name} in table {self.table_name}"
+            f"Index {index_name} created on column {columns} in table {self.table_name}"
+        )
+
+    def create_covering_index(self, index_name, columns, include=None, visible=True):
+        """Create a composite index on `columns`, followed by the `include`
+        columns so that queries reading them are answered from the index alone.
+        The index is built ignored by the optimizer and only made visible
+        once it exists (MariaDB 10.6+), so no query plan changes mid-build.
+        :param index_name: index name
+        :param columns: a sequence of key column names
+        :param include: a sequence of extra column names stored in the index
+        :param visible: make the index visible once built; when false, call
+            `set_index_ignored(index_name, False)` after validating it
+        :return: None
+        """
+        columns = list(columns) + list(include or [])
+        cur = self.conn.cursor()
+        cur.execute(
+            f"""
+            ALTER TABLE `{self.table_name}`
+            ADD INDEX `{index_name}` ({format_index_columns(columns)}) IGNORED;
+        """
+        )
+        print(f"Covering index {index_name} built in table {self.table_name}")
+        if visible:
+            self.set_index_ignored(index_name, False)
+
+    def set_index_ignored(self, index_name, ignored):
+        """Hide an index from the optimizer, or make it visible again
+        :param index_name: index name
+        :param ignored: a boolean, hide the index when true
+        :return: None
+        """
+        cur = self.conn.cursor()
+        cur.execute(
+            f"""
+            ALTER TABLE `{self.table_name}`
+            ALTER INDEX `{index_name}` {"IGNORED" if ignored else "NOT IGNORED"};
+        """
+        )
+        print(
+            f"Index {index_name} in table {self.table_name} is now {'ignored' if ignored else 'visible'}"
         )
 
 
@@ -104,77 +448,352 @@ class PricePaidDataTable(DatabaseTable):
         super().__init__(conn, table_name)
 
     def initialize_pp_data_schema(self):
+        # one partition per year, so each year's files can be loaded into
+        # their own partition concurrently and date range queries only scan
+        # the years they cover; pmax catches transfers after the last year
+        partitions = ",\n".join(
+            [
+                f"PARTITION {get_pp_data_partition_name(year)} VALUES LESS THAN ({year + 1})"
+                for year in range(1995, 2023)
+            ]
+            + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]
+        )
         cur = self.conn.cursor()
         cur.execute(
             f"""
             DROP TABLE IF EXISTS `{self.table_name}`;
             CREATE TABLE IF NOT EXISTS `{self.table_name}` (
-            `transaction_unique_identifier` tinytext COLLATE utf8_bin NOT NULL,
+            `transaction_unique_identifier` char(38) COLLATE utf8_bin NOT NULL,
             `price` int(10) unsigned NOT NULL,
             `date_of_transfer` date NOT NULL,
             `postcode` varchar(8) COLLATE utf8_bin NOT NULL,
             `property_type` varchar(1) COLLATE utf8_bin NOT NULL,
             `new_build_flag` varchar(1) COLLATE utf8_bin NOT NULL,
             `tenure_type` varchar(1) COLLATE utf8_bin NOT NULL,
-            `primary_addressable_object_name` tinytext COLLATE utf8_bin NOT NULL,
-            `secondary_addressable_object_name` tinytext COLLATE utf8_bin NOT NULL,
-            `street` tinytext COLLATE utf8_bin NOT NULL,
-            `locality` tinytext COLLATE utf8_bin NOT NULL,
-            `town_city` tinytext COLLATE utf8_bin NOT NULL,
-            `district` tinytext COLLATE utf8_bin NOT NULL,
-            `county` tinytext COLLATE utf8_bin NOT NULL,
+            `primary_addressable_object_name` varchar(100) COLLATE utf8_bin NOT NULL,
+            `secondary_addressable_object_name` varchar(100) COLLATE utf8_bin NOT NULL,
+            `street` varchar(100) COLLATE utf8_bin NOT NULL,
+            `locality` varchar(60) COLLATE utf8_bin NOT NULL,
+            `town_city` varchar(60) COLLATE utf8_bin NOT NULL,
+            `district` varchar(60) COLLATE utf8_bin NOT NULL,
+            `county` varchar(60) COLLATE utf8_bin NOT NULL,
             `ppd_category_type` varchar(2) COLLATE utf8_bin NOT NULL,
             `record_status` varchar(2) COLLATE utf8_bin NOT NULL,
             `db_id` bigint(20) unsigned NOT NULL
-            ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin AUTO_INCREMENT=1 ;
+            ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin AUTO_INCREMENT=1
+            ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8
+            PARTITION BY RANGE (YEAR(`date_of_transfer`)) (
+            {partitions}
+            );
         """
         )
-        self.conn.commit()
+        _drain_results(cur)
         print(f"Schema for table {self.table_name} initialized")
 
-    def download_pp_data(self, start_year=1995, end_year=2022):
-        base_url = "http://prod.publicdata.landregistry.gov.uk.s3-website-eu-west-1.amazonaws.com/"
-        for year in range(start_year, end_year + 1):
-            if year == 2022:
-                file_name = "pp-2022.csv"
-                urllib.request.urlretrieve(base_url + file_name, file_name)
-            else:
-                for part in range(1, 3):
-                    file_name = "pp-" + str(year) + "-" + "part" + str(part) + ".csv"
-                    urllib.request.urlretrieve(base_url + file_name, file_name)
-            print(f"pp_data for {year} downloaded")
-
-    def load_pp_data_single_year(self, year):
+    def add_primary_key(self, column_name):
+        # every unique key of a partitioned table must contain the partitioning
+        # column, so the primary key is (column_name, date_of_transfer)
         cur = self.conn.cursor()
-        if year == 2022:
-            cur.execute(
-                f"""
-                LOAD DATA LOCAL INFILE 'pp-2022.csv' INTO TABLE `{self.table_name}`
-                FIELDS TERMINATED BY ',' 
-                ENCLOSED BY '"'
-                LINES STARTING BY '' TERMINATED BY '\n';
-            """
-            )
-        else:
-            for part in range(1, 3):
-                file_name = "pp-" + str(year) + "-" + "part" + str(part) + ".csv"
-                cur.execute(
-                    f"""
-                    LOAD DATA LOCAL INFILE '{file_name}' INTO TABLE `{self.table_name}`
-                    FIELDS TERMINATED BY ',' 
-                    ENCLOSED BY '"'
-                    LINES STARTING BY '' TERMINATED BY '\n';
-                """
-                )
-        self.conn.commit()
+        cur.execute(
+            f"""
+            ALTER TABLE `{self.table_name}`
+            ADD PRIMARY KEY (`{column_name}`, `date_of_transfer`),
+            MODIFY `{column_name}` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+            AUTO_INCREMENT=1;
+        """
+        )
+        print(f"Added primary key {column_name} for table {self.table_name}")
+
+    def create_join_indexes(self):
+        """Create the index used by `get_joined_transactions` to probe pp_data by
+        postcode, range-scan the date of transfer within each postcode and filter
+        on property type without reading the row
+        :return: None
+        """
+        self.create_covering_index(
+            "idx_pp_postcode_date",
+            ("postcode", "date_of_transfer"),
+            include=("property_type",),
+        )
+
+    def build_yearly_summary(self, summary_name="pp_yearly_avg"):
+        """Materialize the sum and count of prices per year and property type in
+        table `summary_name`, so that per-year averages read a few hundred rows
+        instead of scanning pp_data; rebuild it after loading more data
+        :param summary_name: name of the summary table
+        :return: None
+        """
+        cur = self.conn.cursor()
+        cur.execute(
+            f"""
+            DROP TABLE IF EXISTS `{summary_name}`;
+            CREATE TABLE `{summary_name}` (
+            PRIMARY KEY (`year`, `property_type`)
+            ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin
+            SELECT YEAR(`date_of_transfer`) AS `year`, `property_type`,
+            SUM(`price`) AS `sum_price`, COUNT(*) AS `cnt`
+            FROM `{self.table_name}`
+            GROUP BY YEAR(`date_of_transfer`), `property_type`;
+        """
+        )
+        _drain_results(cur)
+        print(f"Summary table {summary_name} built from table {self.table_name}")
+
+    def download_pp_data(self, start_year=1995, end_year=2022, max_workers=16):
+        base_url = "http://prod.publicdata.landregistry.gov.uk.s3-website-eu-west-1.amazonaws.com/"
+        file_names = [
+            file_name
+            for year in range(start_year, end_year + 1)
+            for file_name in get_pp_data_file_names(year)
+        ]
+
+        session = create_http_session(pool_maxsize=max_workers)
+
+        def download_single_file(file_name):
+            try:
+                if download_file(session, base_url + file_name, file_name):
+                    print(f"{file_name} downloaded")
+                else:
+                    print(f"{file_name} is up to date")
+            except Exception as e:
+                print(f"Error downloading {file_name}: {e}")
+
+        # downloads are network-bound, so overlap them across a pool of threads
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(download_single_file, file_names))
+        session.close()
+
+    def load_pp_data_file(self, cur, file_name, partition=None):
+        partition_clause = f"PARTITION (`{partition}`)" if partition else ""
+        cur.execute(
+            f"""
+            LOAD DATA LOCAL INFILE '{file_name}' INTO TABLE `{self.table_name}` {partition_clause}
+            FIELDS TERMINATED BY ',' 
+            ENCLOSED BY '"'
+            LINES STARTING BY '' TERMINATED BY '\n';
+        """
+        )
+
+    def load_pp_data_single_year(self, year, cur=None, commit=True):
+        if cur is None:
+            cur = self.conn.cursor()
+        for file_name in get_pp_data_file_names(year):
+            self.load_pp_data_file(cur, file_name, get_pp_data_partition_name(year))
+        if commit:
+            self.conn.commit()
         print(f"pp_data for {year} loaded")
 
-    def load_pp_data(self, start_year=1995, end_year=2022):
+    def load_pp_data(self, start_year=1995, end_year=2022, bulk_mode=False):
         start_year = max(start_year, 1995)
         end_year = min(end_year, 2022)
         # assert start_year <= end_year
+        cur = self.conn.cursor()
+        # statements undoing the bulk_mode settings applied so far, run in order
+        restores = []
+        try:
+            if bulk_mode:
+                # for an initial ingest, load every year in one transaction with
+                # binary logging and per-row checks switched off, and flush the
+                # redo log once per second rather than on every commit: a server
+                # crash during the load can lose up to a second of it, which is
+                # acceptable as the load is simply rerun. sql_log_bin and the
+                # global setting need the SUPER privilege
+                cur.execute("SELECT @@GLOBAL.innodb_flush_log_at_trx_commit")
+                (flush_log_at_trx_commit,) = cur.fetchone()
+                # the global setting comes first so it is also restored first
+                for statement, restore in [
+                    (
+                        "SET GLOBAL innodb_flush_log_at_trx_commit=2",
+                        "SET GLOBAL innodb_flush_log_at_trx_commit="
+                        + f"{flush_log_at_trx_commit}",
+                    ),
+                    ("SET SESSION sql_log_bin=0", "SET SESSION sql_log_bin=1"),
+                    ("SET SESSION unique_checks=0", "SET SESSION unique_checks=1"),
+                    (
+                        "SET SESSION foreign_key_checks=0",
+                        "SET SESSION foreign_key_checks=1",
+                    ),
+                    ("SET SESSION autocommit=0", "SET SESSION autocommit=1"),
+                    (
+                        f"SET SESSION bulk_insert_buffer_size={1 << 30}",
+                        "SET SESSION bulk_insert_buffer_size=DEFAULT",
+                    ),
+                ]:
+                    cur.execute(statement)
+                    restores.append(restore)
+            for year in range(start_year, end_year + 1):
+                self.load_pp_data_single_year(year, cur, commit=not bulk_mode)
+            if bulk_mode:
+                self.conn.commit()
+        except BaseException:
+            # setting autocommit=1 below commits implicitly, so discard
+            # a partial bulk load before restoring the session
+            if bulk_mode:
+                self.conn.rollback()
+            raise
+        finally:
+            for restore in restores:
+                cur.execute(restore)
+
+    def load_pp_data_file_via_insert(self, file_name, batch_size=5000):
+        """Load one pp_data CSV file with batched multi-row INSERTs, for servers
+        where LOAD DATA LOCAL INFILE is disabled
+        :param file_name: the CSV file to load
+        :param batch_size: number of rows inserted and committed per batch
+        :return: None
+        """
+        # the CSV holds every column but db_id, which LOAD DATA sets to 0; every
+        # value must be a placeholder for pymysql to send each batch as a single
+        # multi-row INSERT rather than one statement per row
+        sql = f"INSERT INTO `{self.table_name}` VALUES (" + ", ".join(["%s"] * 17) + ")"
+        cur = self.conn.cursor()
+        for chunk in pd.read_csv(
+            file_name,
+            header=None,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=batch_size,
+        ):
+            cur.executemany(
+                sql, [(*row, 0) for row in chunk.itertuples(index=False, name=None)]
+            )
+            self.conn.commit()
+
+    def load_pp_data_via_insert(self, start_year=1995, end_year=2022, batch_size=5000):
+        """Load the pp_data CSV files with batched INSERTs instead of LOAD DATA
+        :param start_year: first year to load
+        :param end_year: last year to load
+        :param batch_size: number of rows inserted and committed per batch
+        :return: None
+        """
+        start_year = max(start_year, 1995)
+        end_year = min(end_year, 2022)
         for year in range(start_year, end_year + 1):
-            self.load_pp_data_single_year(year)
+            for file_name in get_pp_data_file_names(year):
+                self.load_pp_data_file_via_insert(file_name, batch_size)
+            print(f"pp_data for {year} loaded")
+
+    def load_pp_data_through_fifo(
+        self, start_year=1995, end_year=2022, fifo_name="pp_all.csv"
+    ):
+        """Load all the pp_data CSV files with a single LOAD DATA statement, by
+        streaming them one after another through a named pipe. Only available
+        on platforms that provide `os.mkfifo`.
+        :param start_year: first year to load
+        :param end_year: last year to load
+        :param fifo_name: path of the named pipe to create
+        :return: None
+        """
+        start_year = max(start_year, 1995)
+        end_year = min(end_year, 2022)
+        file_names = [
+            file_name
+            for year in range(start_year, end_year + 1)
+            for file_name in get_pp_data_file_names(year)
+        ]
+
+        os.mkfifo(fifo_name)
+
+        def write_files():
+            try:
+                with open(fifo_name, "wb") as fifo:
+                    for file_name in file_names:
+                        with open(file_name, "rb") as infile:
+                            shutil.copyfileobj(infile, fifo, 1 << 20)
+            except BrokenPipeError:
+                print("LOAD DATA stopped reading the pp_data pipe")
+
+        writer = threading.Thread(target=write_files, daemon=True)
+        writer.start()
+        try:
+            self.load_pp_data_file(self.conn.cursor(), fifo_name)
+            self.conn.commit()
+        finally:
+            if writer.is_alive():
+                # unblock a writer still waiting for the pipe to be opened
+                os.close(os.open(fifo_name, os.O_RDONLY | os.O_NONBLOCK))
+            writer.join()
+            os.remove(fifo_name)
+        print(f"pp_data from {start_year} to {end_year} loaded")
+
+    def load_pp_data_parallel(
+        self,
+        user,
+        password,
+        host,
+        database,
+        port=3306,
+        start_year=1995,
+        end_year=2022,
+        max_workers=4,
+    ):
+        """Load the pp_data CSV files concurrently, one LOAD DATA per file into
+        the partition for its year, each running in its own session taken from
+        a pool of connections
+        :param user: username
+        :param password: password
+        :param host: host url
+        :param database: database
+        :param port: port number
+        :param start_year: first year to load
+        :param end_year: last year to load
+        :param max_workers: number of concurrent sessions
+        :return: None
+        """
+        start_year = max(start_year, 1995)
+        end_year = min(end_year, 2022)
+        jobs = [
+            (year, file_name)
+            for year in range(start_year, end_year + 1)
+            for file_name in get_pp_data_file_names(year)
+        ]
+
+        pool = queue.Queue()
+        for _ in range(max_workers):
+            conn = create_connection(user, password, host, database, port)
+            if conn is None:
+                continue
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SET unique_checks=0;
+                SET foreign_key_checks=0;
+                SET autocommit=0;
+            """
+            )
+            _drain_results(cur)
+            pool.put(conn)
+        if pool.empty():
+            raise RuntimeError("No connection available for loading pp_data")
+
+        def load_single_file(job):
+            year, file_name = job
+            conn = pool.get()
+            try:
+                self.load_pp_data_file(
+                    conn.cursor(), file_name, get_pp_data_partition_name(year)
+                )
+                conn.commit()
+                print(f"{file_name} loaded")
+            finally:
+                pool.put(conn)
+
+        try:
+            with ThreadPoolExecutor(max_workers=pool.qsize()) as executor:
+                list(executor.map(load_single_file, jobs))
+        finally:
+            while not pool.empty():
+                conn = pool.get()
+                conn_cur = conn.cursor()
+                conn_cur.execute(
+                    """
+                    SET unique_checks=1;
+                    SET foreign_key_checks=1;
+                    SET autocommit=1;
+                """
+                )
+                _drain_results(conn_cur)
+                close_connection(conn)
 
 
 class PostcodeData(DatabaseTable):
@@ -213,19 +832,33 @@ class PostcodeData(DatabaseTable):
             ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin;
         """
         )
-        self.conn.commit()
+        _drain_results(cur)
         print(f"Schema for table {self.table_name} initialized")
 
+    def create_join_indexes(self):
+        """Create a covering index so the bbox filter in `get_joined_transactions`
+        is resolved from the index alone, and an index for lookups by postcode
+        :return: None
+        """
+        self.create_covering_index(
+            "idx_postcode_latlon", ("lattitude", "longitude"), include=("postcode",)
+        )
+        self.create_index("idx_pc_postcode", "postcode")
+
     def download_postcode_data(self):
         postcode_data_url = (
             "https://www.getthedata.com/downloads/open_postcode_geo.csv.zip"
         )
-        r = requests.get(postcode_data_url)
-        with open("open_postcode_geo.csv.zip", "wb") as outfile:
-            outfile.write(r.content)
-
-        with zipfile.ZipFile("open_postcode_geo.csv.zip", "r") as zip_ref:
-            zip_ref.extractall(".")
+        # spool the archive chunk by chunk, spilling to disk only past 64 MiB,
+        # and extract from the spool rather than buffering it whole in memory
+        with tempfile.SpooledTemporaryFile(max_size=64 << 20) as buffer:
+            with requests.get(postcode_data_url, stream=True) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=1 << 20):
+                    buffer.write(chunk)
+            buffer.seek(0)
+            with zipfile.ZipFile(buffer, "r") as zip_ref:
+                zip_ref.extractall(".")
         print("postcode data downloaded")
 
     def load_postcode_data(self):
@@ -241,13 +874,34 @@ class PostcodeData(DatabaseTable):
         print(f"postcode_data loaded")
 
 
+def _centroid_xy(geometry):
+    """Get the centroid coordinates of geometries as arrays. Points, the common
+    case for POIs, are their own centroid and are read directly.
+    :param geometry: a GeoSeries
+    :return: a tuple (xs, ys) of float64 numpy arrays
+    """
+    is_point = (geometry.geom_type == "Point").to_numpy()
+    xs = np.empty(len(geometry))
+    ys = np.empty(len(geometry))
+    points = geometry[is_point]
+    xs[is_point] = points.x.to_numpy()
+    ys[is_point] = points.y.to_numpy()
+    # skipped when there is nothing else, as GeoSeries.centroid warns about a
+    # geographic CRS even for an empty selection
+    if not is_point.all():
+        centroids = geometry[~is_point].centroid
+        xs[~is_point] = centroids.x.to_numpy()
+        ys[~is_point] = centroids.y.to_numpy()
+    return xs, ys
+
+
 def download_POI_around_coordinate(
     latitude,
     longitude,
     box_width=0.02,
     box_height=0.02,
     tags={},
-    columns=["name", "addr:city", "addr:postcode", "addr:street", "geometry"],
+    columns=None,
 ):
     """Download POI as specified by tags around a coordinate
     :param latitude: latitude
@@ -255,26 +909,117 @@ def download_POI_around_coordinate(
     :param box_width: width of bbox
     :param box_height: height of bbox
     :param tags: a dict of POI tags
-    :param columns: a list of interested column names
-    :return: a geopandas dataframe containing points of interest
+    :param columns: a list of interested column names, POI_COLUMNS when None;
+        the tag keys are always kept as well
+    :return: a geopandas dataframe containing points of interest, with the centroid
+        of each POI in columns `_cx` and `_cy`
     """
     north = latitude + box_height / 2
     south = latitude - box_height / 2
     west = longitude - box_width / 2
     east = longitude + box_width / 2
 
-    pois = ox.geometries_from_bbox(north, south, east, west, tags)
+    # request the bbox snapped outwards to a fixed grid, so that nearby
+    # coordinates issue the same Overpass query and hit the osmnx cache,
+    # then clip the result back to the exact bbox
+    pois = ox.geometries_from_bbox(
+        math.ceil(north / POI_BBOX_QUANTUM) * POI_BBOX_QUANTUM,
+        math.floor(south / POI_BBOX_QUANTUM) * POI_BBOX_QUANTUM,
+        math.ceil(east / POI_BBOX_QUANTUM) * POI_BBOX_QUANTUM,
+        math.floor(west / POI_BBOX_QUANTUM) * POI_BBOX_QUANTUM,
+        tags,
+    )
+    pois = pois.cx[west:east, south:north]
 
-    for key in tags.keys():
-        if key not in columns:
-            columns.append(key)
-    present_columns = [key for key in columns if key in pois.columns]
+    if columns is None:
+        columns = POI_COLUMNS
+    present_columns = [
+        key for key in dict.fromkeys([*columns, *tags]) if key in pois.columns
+    ]
 
-    return pois[present_columns]
+    # distance features only need the centroid of each POI, compute it once here
+    xs, ys = _centroid_xy(pois.geometry)
+    return pois[present_columns].assign(_cx=xs, _cy=ys)
+
+
+def _freeze_tags(tags):
+    """Convert a dict of POI tags into a hashable key, lists becoming tuples
+    :param tags: a dict of POI tags
+    :return: a sorted tuple of (key, value) pairs
+    """
+    return tuple(
+        sorted(
+            (key, tuple(value) if isinstance(value, list) else value)
+            for key, value in tags.items()
+        )
+    )
+
+
+@lru_cache(maxsize=256)
+def _download_POI_cached(latitude, longitude, box_width, box_height, frozen_tags):
+    """Memoized `download_POI_around_coordinate`; the returned POIs are shared
+    between callers and must not be modified
+    :param latitude: latitude
+    :param longitude: longitude
+    :param box_width: width of bbox
+    :param box_height: height of bbox
+    :param frozen_tags: POI tags as returned by `_freeze_tags`
+    :return: a geopandas dataframe containing points of interest
+    """
+    tags = {
+        key: list(value) if isinstance(value, tuple) else value
+        for key, value in frozen_tags
+    }
+    return download_POI_around_coordinate(
+        latitude, longitude, box_width=box_width, box_height=box_height, tags=tags
+    )
+
+
+def _merge_tags(tag_dicts):
+    """Merge several dicts of POI tags into one that matches a POI whenever any of
+    them does: a key wanted with True stays True, otherwise its values are combined
+    :param tag_dicts: an iterable of dicts of POI tags
+    :return: a dict of POI tags
+    """
+    merged = {}
+    for tags in tag_dicts:
+        for key, value in tags.items():
+            if value is True or merged.get(key) is True:
+                merged[key] = True
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            merged[key] = list(dict.fromkeys(merged.get(key, []) + values))
+    return merged
+
+
+def _select_POI_by_tags(pois, tags):
+    """Select the POIs matching any of `tags`, following the osmnx semantics of a
+    tags dict: True matches any value of the key, a string or a list of strings
+    matches those values
+    :param pois: a geodataframe representing Points of Interest
+    :param tags: a dict of POI tags
+    :return: a geodataframe of the matching POIs
+    """
+    mask = np.zeros(len(pois), dtype=bool)
+    for key, value in tags.items():
+        if key not in pois.columns:
+            continue
+        if value is True:
+            mask |= pois[key].notna().to_numpy()
+        elif isinstance(value, str):
+            mask |= (pois[key] == value).to_numpy()
+        else:
+            mask |= pois[key].isin(value).to_numpy()
+    return pois[mask]
 
 
 def download_POI_for_feature_list(
-    latitude, longitude, feature_box_width, feature_box_height, features
+    latitude,
+    longitude,
+    feature_box_width,
+    feature_box_height,
+    features,
+    poi_cache=None,
 ):
     """Download POIs from OpenStreetMap as specified by the tags attributes in `features`
     :param latitude: latitude
@@ -282,23 +1027,114 @@ def download_POI_for_feature_list(
     :param feature_box_width: width of feature bbox
     :param feature_box_height: height of feature bbox
     :param features: a JSON encoding of features
+    :param poi_cache: a cache built by `build_poi_cache` covering the bbox, if any
     :return: a mapping from feature name to POIs
     """
-    pois_map = {}
-    for name, prop in features.items():
-        tag = prop["tags"]
-        pois = download_POI_around_coordinate(
-            latitude,
-            longitude,
-            box_width=feature_box_width,
-            box_height=feature_box_height,
-            tags=tag,
+    if poi_cache is not None:
+        return query_poi_cache(
+            poi_cache, latitude, longitude, feature_box_width, feature_box_height
         )
-        pois_map[name] = pois
+
+    # a single Overpass request for the union of every feature's tags, answered
+    # from memory when the same area was requested before, and then split into
+    # the POIs of each feature locally
+    feature_tags = {name: prop["tags"] for name, prop in features.items()}
+    merged_tags = _merge_tags(feature_tags.values())
+    pois = _download_POI_cached(
+        round(latitude, 5),
+        round(longitude, 5),
+        feature_box_width,
+        feature_box_height,
+        _freeze_tags(merged_tags),
+    )
+
+    pois_map = {}
+    for name, tags in feature_tags.items():
+        other_keys = [
+            key for key in merged_tags if key not in tags and key in pois.columns
+        ]
+        pois_map[name] = _select_POI_by_tags(pois, tags).drop(columns=other_keys)
         print(f"POIs for feature: {name} downloaded")
     return pois_map
 
 
+def _poi_cache_file(path, latitude, longitude, box_width, box_height, name, tags):
+    """Get the file a feature's POIs are persisted in by `build_poi_cache`, named
+    after the feature and a digest of the region and its tags
+    :param path: the cache directory
+    :param latitude: latitude of the region centre
+    :param longitude: longitude of the region centre
+    :param box_width: width of the region bbox
+    :param box_height: height of the region bbox
+    :param name: feature name
+    :param tags: the feature's tags
+    :return: a file path
+    """
+    digest = hashlib.sha1(
+        json.dumps(
+            [latitude, longitude, box_width, box_height, tags], sort_keys=True
+        ).encode()
+    ).hexdigest()
+    return os.path.join(path, f"{name}-{digest[:16]}.pkl")
+
+
+def build_poi_cache(latitude, longitude, box_width, box_height, features, path=None):
+    """Download the POIs of every feature once for a large region, so that POIs
+    around any coordinate within it can be answered locally by `query_poi_cache`.
+    When `path` is given, each feature is pickled in `path` under a name keyed by
+    the region and the feature's tags, and read back from there on later calls
+    for the same region and tags.
+    :param latitude: latitude of the region centre
+    :param longitude: longitude of the region centre
+    :param box_width: width of the region bbox
+    :param box_height: height of the region bbox
+    :param features: a JSON encoding of features
+    :param path: a directory to persist the cache in, if any
+    :return: a mapping from feature name to POIs
+    """
+    if path is not None:
+        files = {
+            name: _poi_cache_file(
+                path, latitude, longitude, box_width, box_height, name, prop["tags"]
+            )
+            for name, prop in features.items()
+        }
+        if all(os.path.exists(file) for file in files.values()):
+            return {name: pd.read_pickle(file) for name, file in files.items()}
+
+    poi_cache = download_POI_for_feature_list(
+        latitude, longitude, box_width, box_height, features
+    )
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+        for name, pois in poi_cache.items():
+            pois.to_pickle(files[name])
+    return poi_cache
+
+
+def query_poi_cache(poi_cache, latitude, longitude, box_width, box_height):
+    """Select the POIs within the bbox around a coordinate from a cache built by
+    `build_poi_cache`, without querying OpenStreetMap. The lookup goes through the
+    spatial index (an STRtree) of each cached layer, which geopandas builds on
+    first use and keeps on the layer for later queries.
+    :param poi_cache: a mapping from feature name to POIs
+    :param latitude: latitude
+    :param longitude: longitude
+    :param box_width: width of bbox
+    :param box_height: height of bbox
+    :return: a mapping from feature name to POIs
+    """
+    north = latitude + box_height / 2
+    south = latitude - box_height / 2
+    west = longitude - box_width / 2
+    east = longitude + box_width / 2
+    bbox = box(west, south, east, north)
+    return {
+        name: pois.iloc[np.sort(pois.sindex.query(bbox, predicate="intersects"))]
+        for name, pois in poi_cache.items()
+    }
+
+
 def get_joined_transactions(
     conn,
     start_date,
@@ -331,32 +1167,30 @@ def get_joined_transactions(
     if longitude is not None and box_width is None:
         raise RuntimeError("box_width needs to be defined when passing in a longitude")
 
-    inner_query = f"""
-    SELECT postcode, lattitude, longitude 
-    FROM {postcode_data} 
-    WHERE true"""
+    # all literals are bound as parameters, so the driver escapes them and
+    # nothing is interpolated into the query raw.
+    # postcode_data is read first through its (lattitude, longitude, postcode)
+    # index, then pp_data is probed by postcode for each matching row
+    sql_query = f"""
+    SELECT p.*, c.postcode, c.lattitude, c.longitude
+    FROM `{postcode_data}` AS c
+    STRAIGHT_JOIN `{pp_data}` AS p
+    ON p.postcode = c.postcode
+    WHERE p.date_of_transfer BETWEEN date(%s) AND date(%s)"""
+    args = [start_date, end_date]
 
     if latitude is not None:
-        inner_query = (
-            inner_query
-            + f" and lattitude <= {latitude + box_height / 2} and lattitude >= {latitude - box_height / 2}"
-        )
+        sql_query = sql_query + " AND c.lattitude BETWEEN %s AND %s"
+        args += [latitude - box_height / 2, latitude + box_height / 2]
     if longitude is not None:
-        inner_query = (
-            inner_query
-            + f" and longitude <= {longitude + box_width / 2} and longitude >= {longitude - box_width / 2}"
-        )
-
-    sql_query_prefix = f"SELECT * FROM `{pp_data}` AS p INNER JOIN ( "
-    sql_query_suffix = f""" 
-    ) AS c 
-    ON p.postcode = c.postcode 
-    WHERE date_of_transfer >= date({start_date.strftime("%Y%m%d")}) and date_of_transfer <= date({end_date.strftime("%Y%m%d")})"""
+        sql_query = sql_query + " AND c.longitude BETWEEN %s AND %s"
+        args += [longitude - box_width / 2, longitude + box_width / 2]
     if property_type is not None:
-        sql_query_suffix = sql_query_suffix + f" and property_type = '{property_type}'"
+        sql_query = sql_query + " AND p.property_type = %s"
+        args.append(property_type)
     if limit is not None:
-        sql_query_suffix = sql_query_suffix + f" LIMIT {limit}"
+        sql_query = sql_query + " LIMIT %s"
+        args.append(int(limit))
 
-    sql_query = sql_query_prefix + inner_query + sql_query_suffix
-    df = pd.read_sql(sql_query, con=conn)
+    df = read_sql_in_chunks(conn, sql_query, args)
     return df
@@ -2,35 +2,110 @@
 
 import datetime
 import statsmodels.api as sm
-from address import (
-    get_joined_transactions,
-    download_POI_for_feature_list,
-    calculate_features,
-)
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from .access import get_joined_transactions, download_POI_for_feature_list
+from .assess import calculate_features
+import numpy as np
 import pandas as pd
 
 """Address a particular question that arises from the data"""
 
+# The design matrix `X`, the response `y` and the `db_ids` of a training set, so
+# that leave-one-out folds can be taken as row masks rather than rebuilt
+_Design = namedtuple("_Design", ["X", "y", "db_ids"])
+
+# statsmodels families hold no fitted state, so a single instance is shared by every fit
+_FAMILIES = {"poisson": sm.families.Poisson(), "gaussian": sm.families.Gaussian()}
+
+
+# leave-one-out folds whose removed row has a hat value above this are refitted
+# in full, as the one-step update is inaccurate for high-leverage rows
+LOO_MAX_LEVERAGE = 0.99
+
+
+def _fit_glm(y, design, family):
+    """Fit a GLM of `family` on `design`
+    :param y: a numpy array of the response
+    :param design: a numpy array representing the design matrix
+    :param family: a statsmodels family instance
+    :return: the fitted GLM results
+    """
+    results_basis = sm.GLM(y, design, family=family).fit()
+
+    print("Feature weights: ", results_basis.params)
+
+    return results_basis
+
+
+def _fit_glm_predict(y, design, observed, family):
+    """Fit a GLM of `family` on `design` and predict the response for `observed`
+    :param y: a numpy array of the response
+    :param design: a numpy array representing the design matrix
+    :param observed: a 2D numpy array with a single row of observed features
+    :param family: a statsmodels family instance
+    :return: the predicted value as a float
+    """
+    return _fit_glm(y, design, family).predict(observed)[0]
+
+
+class _LeaveOneOut:
+    """Approximate leave-one-out GLM fits from a single fit on the full design.
+    Removing row i moves the coefficients by the one-step update
+    -(X'WX)^-1 s_i / (1 - h_i), where s_i is the score of row i and h_i its hat
+    value; rows with a hat value above LOO_MAX_LEVERAGE are refitted in full.
+    :param design: a _Design of the full training set
+    :param family: a statsmodels family instance
+    """
+
+    def __init__(self, design, family):
+        self.design = design
+        self.family = family
+        self.results = _fit_glm(design.y, design.X, family)
+        self.hat = self.results.get_hat_matrix_diag()
+        self.score = self.results.model.score_obs(self.results.params)
+        self.cov = self.results.cov_params()
+
+    def params_without(self, db_id):
+        """Get the coefficients of the GLM fitted without the row `db_id`
+        :param db_id: the db_id of the row to leave out
+        :return: a numpy array of coefficients
+        """
+        (rows,) = np.nonzero(self.design.db_ids == db_id)
+        if len(rows) == 0:
+            return self.results.params
+        print(f"Successfully removed the entry with db_id: {db_id}")
+        i = rows[0]
+        if self.hat[i] > LOO_MAX_LEVERAGE:
+            keep = self.design.db_ids != db_id
+            return _fit_glm(
+                self.design.y[keep], self.design.X[keep], self.family
+            ).params
+        return self.results.params - self.cov @ self.score[i] / (1 - self.hat[i])
+
+    def predict_without(self, db_id, observed):
+        """Predict the response for `observed` with the GLM fitted without the row `db_id`
+        :param db_id: the db_id of the row to leave out
+        :param observed: a 1D numpy array of observed features
+        :return: the predicted value as a float
+        """
+        return self.family.link.inverse(observed @ self.params_without(db_id))
+
 
 def poisson_regression_predict(df, design, observed_df):
-    """Fit a poisson regression model with lasso regularization using feature `design`.
+    """Fit a poisson regression model using feature `design`.
     Then use the model to predict housing price based on observed features `observed_df`
     :param df: a dataframe containing column `price`
     :param design: a dataframe representing the design matrix
     :param observed_df: a dataframe for observed features
     :return: the predicted housing price as a float
     """
-    m_linear_basis = sm.GLM(
-        df["price"].to_numpy(), design, family=sm.families.Poisson()
+    return _fit_glm_predict(
+        df["price"].to_numpy(),
+        design,
+        observed_df.drop(["lattitude", "longitude"], axis=1).values,
+        _FAMILIES["poisson"],
     )
-    results_basis = m_linear_basis.fit_regularized(alpha=0.05, L1_wt=1)
-    results_basis = m_linear_basis.fit()
-
-    print("Feature weights: ", results_basis.params)
-
-    return results_basis.predict(
-        observed_df.drop(["lattitude", "longitude"], axis=1).values
-    )[0]
 
 
 def gaussian_regression_predict(df, design, observed_df):
@@ -41,42 +116,34 @@ def gaussian_regression_predict(df, design, observed_df):
     :param observed_df: a dataframe for observed features
     :return: the predicted housing price as a float
     """
-    m_linear_basis = sm.GLM(
-        df["price"].to_numpy(), design, family=sm.families.Gaussian()
+    return _fit_glm_predict(
+        df["price"].to_numpy(),
+        design,
+        observed_df.drop(["lattitude", "longitude"], axis=1).values,
+        _FAMILIES["gaussian"],
     )
-    results_basis = m_linear_basis.fit()
 
-    print("Feature weights: ", results_basis.params)
 
-    return results_basis.predict(
-        observed_df.drop(["lattitude", "longitude"], axis=1).values
-    )[0]
+def _get_family(model_name):
+    """Return the statsmodels family for the specified model name
+    :param model_name: the name of the GLM to be used
+    :return: a statsmodels family instance
+    """
+    if model_name not in _FAMILIES:
+        raise NotImplementedError
+    return _FAMILIES[model_name]
 
 
-def predict_price(
-    conn,
-    latitude,
-    longitude,
-    date,
-    property_type,
-    args,
-    model_name="poisson",
-    debug_mod=True,
-    df_filter=None,
-):
-    """Retrieve the joined transaction records from database and construct a
-    training set of housing prices at the specified location with dynamically
-    adjusted bbox size. Fit the specified GLM, then predict the price for the house with
-    `property_type` at certain date at the specified location.
+def _build_training(conn, latitude, longitude, date, property_type, args):
+    """Retrieve the joined transaction records around the specified location with
+    dynamically adjusted bbox size, and download the POIs of every feature in args
     :param conn: a connection to the database
     :param latitude: latitude
     :param longitude: longitude
     :param date: a datetime object
+    :param property_type: property_type of the housing
     :param args: a dict representing hyperparameters
-    :param model_name: the name of the GLM to be used
-    :param debug_mode: a boolean, only print features when set to true
-    :param df_filter: a function to filter out validation entry from the training set
-    :return: a flaot value representing the predicted housing price
+    :return: a tuple (transaction_df, pois_map, bbox_size), pois_map is None when no transaction is found
     """
     start_date = date - datetime.timedelta(days=args["time_range"] // 2)
     end_date = date + datetime.timedelta(days=args["time_range"] // 2)
@@ -110,45 +177,140 @@ def predict_price(
     # Build up the training set from housing of all types
     if len(transaction_df) < required_sample_size:
         transaction_df = get_joined_transactions(
-            conn, latitude, longitude, bbox_size, bbox_size, start_date, end_date
+            conn, start_date, end_date, latitude, longitude, bbox_size, bbox_size
         )
 
     print(f"Retrieved {len(transaction_df)} transactions with bbox size = {bbox_size}")
 
     if len(transaction_df) == 0:
-        return "No samples in the training set"
+        return transaction_df, None, bbox_size
 
-    # used to filter out validation entry during evaluation
-    if df_filter is not None:
-        transaction_df = df_filter(transaction_df)
+    pois_map = download_POI_for_feature_list(
+        latitude, longitude, bbox_size, bbox_size, features
+    )
+    return transaction_df, pois_map, bbox_size
 
-    # bbox for features
-    feature_bbox_size = bbox_size * 2
+
+def _build_design(
+    transaction_df, latitudes, longitudes, pois_map, bbox_size, args, debug_mod=True
+):
+    """Compute features for the training set and the observed locations in one pass
+    :param transaction_df: the training set of price data
+    :param latitudes: a sequence of observed latitudes
+    :param longitudes: a sequence of observed longitudes
+    :param pois_map: a mapping from feature name to POIs
+    :param bbox_size: the bbox size the training set was retrieved with
+    :param args: a dict representing hyperparameters
+    :param debug_mode: a boolean, only print features when set to true
+    :return: a pair (design, observed), design is a _Design of the training set and
+        observed is a numpy array with one row of features per observed location
+    """
     dist_threshold = bbox_size / 2
+    n = len(transaction_df)
 
-    df = transaction_df[["price", "lattitude", "longitude"]].copy()
-    pois_map = download_POI_for_feature_list(
-        latitude, longitude, bbox_size, bbox_size, features
+    # the first n rows are the training set, the rest are the observed locations
+    locations = pd.DataFrame(
+        {
+            "lattitude": np.concatenate(
+                [transaction_df["lattitude"].to_numpy(dtype=float), latitudes]
+            ),
+            "longitude": np.concatenate(
+                [transaction_df["longitude"].to_numpy(dtype=float), longitudes]
+            ),
+        }
     )
-    df = calculate_features(df, features, dist_threshold, pois_map)
-    df["one"] = 10
+    locations = calculate_features(
+        locations, args["features"], dist_threshold, pois_map
+    )
+    locations["one"] = 10
     if debug_mod:
-        print("Features: ", df)
+        print("Features: ", locations.iloc[:n])
+        print("Observed features: ", locations.iloc[n:].reset_index(drop=True))
 
-    observed_df = pd.DataFrame({"lattitude": [latitude], "longitude": [longitude]})
-    observed_df = calculate_features(observed_df, features, dist_threshold, pois_map)
-    observed_df["one"] = 10
-    if debug_mod:
-        print("Observed features: ", observed_df)
+    X = locations.drop(["lattitude", "longitude"], axis=1).to_numpy(dtype=float)
+    design = _Design(
+        X=X[:n],
+        y=transaction_df["price"].to_numpy(),
+        db_ids=transaction_df["db_id"].to_numpy(),
+    )
+    return design, X[n:]
 
-    design = df.drop(["price", "lattitude", "longitude"], axis=1).values
 
-    if model_name == "poisson":
-        return poisson_regression_predict(df, design, observed_df)
-    elif model_name == "gaussian":
-        return gaussian_regression_predict(df, design, observed_df)
-    else:
-        raise NotImplementedError
+def _fit_predict(
+    transaction_df,
+    latitude,
+    longitude,
+    pois_map,
+    bbox_size,
+    args,
+    model_name="poisson",
+    debug_mod=True,
+):
+    """Compute features for the training set and the observed location, fit the
+    specified GLM and predict the price at the observed location
+    :param transaction_df: the training set of price data
+    :param latitude: latitude
+    :param longitude: longitude
+    :param pois_map: a mapping from feature name to POIs
+    :param bbox_size: the bbox size the training set was retrieved with
+    :param args: a dict representing hyperparameters
+    :param model_name: the name of the GLM to be used
+    :param debug_mode: a boolean, only print features when set to true
+    :return: a float value representing the predicted housing price
+    """
+    family = _get_family(model_name)
+    design, observed = _build_design(
+        transaction_df, [latitude], [longitude], pois_map, bbox_size, args, debug_mod
+    )
+    return _fit_glm_predict(design.y, design.X, observed, family)
+
+
+def predict_price(
+    conn,
+    latitude,
+    longitude,
+    date,
+    property_type,
+    args,
+    model_name="poisson",
+    debug_mod=True,
+    df_filter=None,
+):
+    """Retrieve the joined transaction records from database and construct a
+    training set of housing prices at the specified location with dynamically
+    adjusted bbox size. Fit the specified GLM, then predict the price for the house with
+    `property_type` at certain date at the specified location.
+    :param conn: a connection to the database
+    :param latitude: latitude
+    :param longitude: longitude
+    :param date: a datetime object
+    :param args: a dict representing hyperparameters
+    :param model_name: the name of the GLM to be used
+    :param debug_mode: a boolean, only print features when set to true
+    :param df_filter: a function to filter out validation entry from the training set
+    :return: a flaot value representing the predicted housing price
+    """
+    transaction_df, pois_map, bbox_size = _build_training(
+        conn, latitude, longitude, date, property_type, args
+    )
+
+    if len(transaction_df) == 0:
+        return "No samples in the training set"
+
+    # used to filter out validation entry during evaluation
+    if df_filter is not None:
+        transaction_df = df_filter(transaction_df)
+
+    return _fit_predict(
+        transaction_df,
+        latitude,
+        longitude,
+        pois_map,
+        bbox_size,
+        args,
+        model_name,
+        debug_mod,
+    )
 
 
 def filter_out_validation_data(transaction_df, val_db_id):
@@ -157,38 +319,107 @@ def filter_out_validation_data(transaction_df, val_db_id):
     :param val_db_id: the db_id of the validation data point
     :return: a dataframe, with one entry removed from transaction_df
     """
-    filtered_df = transaction_df[transaction_df.db_id != val_db_id]
+    filtered_df = transaction_df[transaction_df.db_id.to_numpy() != val_db_id]
     if len(filtered_df) < len(transaction_df):
         print(f"Successfully removed the entry with db_id: {val_db_id}")
     return filtered_df
 
 
-def evaluate_model(conn, validation_df, model_name, args):
-    """Evaluate the specified model using the known price of a property
+def _evaluate_bucket(
+    transaction_df, pois_map, bbox_size, latitudes, longitudes, db_ids, model_name, args
+):
+    """Predict the price of every validation row of a bucket, leaving each row out
+    of the training set in turn. Run in a worker process by `evaluate_model`.
+    :param transaction_df: the training set of price data of the bucket
+    :param pois_map: a mapping from feature name to POIs
+    :param bbox_size: the bbox size the training set was retrieved with
+    :param latitudes: a list of latitudes of the validation rows
+    :param longitudes: a list of longitudes of the validation rows
+    :param db_ids: a list of db_ids of the validation rows
+    :param model_name: a string representing model name
+    :param args: hyperparameters to the model
+    :return: a list of predicted property prices
+    """
+    # features are computed and the GLM is fitted once per bucket, each fold
+    # only updates the fit for its own row
+    design, observed = _build_design(
+        transaction_df,
+        latitudes,
+        longitudes,
+        pois_map,
+        bbox_size,
+        args,
+        debug_mod=False,
+    )
+    loo = _LeaveOneOut(design, _get_family(model_name))
+    return [loo.predict_without(db_id, observed[i]) for i, db_id in enumerate(db_ids)]
+
+
+def evaluate_model(conn, validation_df, model_name, args, max_workers=None):
+    """Evaluate the specified model using the known price of a property.
+    Validation rows are grouped into buckets of nearby location, same month and
+    same property type, and the training set and POIs are retrieved once per
+    bucket around its first row; `args["bucket_decimals"]` (default 2) sets how
+    many decimals latitude and longitude are rounded to. Features and fits of a
+    bucket run in a process pool while the next bucket's data is retrieved.
     :param conn: a connection to db
     :param validation_df: the validation dataset of property price
     :param model_name: a string representing model name
     :param args: hyperparameters to the model
+    :param max_workers: number of worker processes, os.cpu_count() when None
     :return: a pair of arrays containing real property prices and predicted property prices
 
     """
-    real_price_ls = []
-    predicted_price_ls = []
-    for _, row in validation_df.iterrows():
-        val_db_id = row.db_id
-        real_price = row.price
-        filter_fn = lambda df: filter_out_validation_data(df, val_db_id)
-        predicted_price = predict_price(
-            conn,
-            row.lattitude,
-            row.longitude,
-            row.date_of_transfer,
+    # fail on an unknown model before any data is retrieved
+    _get_family(model_name)
+    decimals = args.get("bucket_decimals", 2)
+    buckets = {}
+    for position, row in enumerate(validation_df.itertuples(index=False)):
+        key = (
+            round(row.lattitude, decimals),
+            round(row.longitude, decimals),
+            row.date_of_transfer.year,
+            row.date_of_transfer.month,
             row.property_type,
-            args,
-            model_name,
-            debug_mod=False,
-            df_filter=filter_fn,
         )
-        real_price_ls.append(real_price)
-        predicted_price_ls.append(predicted_price)
+        buckets.setdefault(key, []).append((position, row))
+
+    real_price_ls = [None] * len(validation_df)
+    predicted_price_ls = [None] * len(validation_df)
+    futures = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for rows in buckets.values():
+            _, anchor = rows[0]
+            transaction_df, pois_map, bbox_size = _build_training(
+                conn,
+                anchor.lattitude,
+                anchor.longitude,
+                anchor.date_of_transfer,
+                anchor.property_type,
+                args,
+            )
+            for position, row in rows:
+                real_price_ls[position] = row.price
+            if len(transaction_df) == 0:
+                for position, _ in rows:
+                    predicted_price_ls[position] = "No samples in the training set"
+                continue
+
+            # the connection stays in this process, workers only get the data
+            future = executor.submit(
+                _evaluate_bucket,
+                transaction_df,
+                pois_map,
+                bbox_size,
+                [row.lattitude for _, row in rows],
+                [row.longitude for _, row in rows],
+                [row.db_id for _, row in rows],
+                model_name,
+                args,
+            )
+            futures.append(([position for position, _ in rows], future))
+
+        for positions, future in futures:
+            for position, predicted_price in zip(positions, future.result()):
+                predicted_price_ls[position] = predicted_price
     return real_price_ls, predicted_price_ls
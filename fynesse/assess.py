@@ -1,19 +1,28 @@
 from .config import *
-from access import download_POI_for_feature_list
+from .access import _centroid_xy, download_POI_for_feature_list, read_sql_in_chunks
 
 import mlai
 import mlai.plot as plot
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.preprocessing import StandardScaler
+from scipy.spatial import cKDTree
 import geopandas as gpd
 import osmnx as ox
 
+import os
 import math
-import random
+import hashlib
+import weakref
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 
 """Place commands in this file to assess the data you have downloaded. How are missing values encoded, how are outliers encoded? What do columns represent, makes sure they are correctly labeled. How is the data indexed. Create visualisation routines to assess the data (e.g. in bokeh). Ensure that date formats are correct and correctly timezoned."""
 
@@ -33,13 +42,29 @@ def get_bbox(latitude, longitude, box_width, box_height):
     return (north, south, west, east)
 
 
+def _query_to_df(conn, sql_query, args=None):
+    """Run sql_query on a plain cursor and build a dataframe from the fetched rows
+    :param conn: a connection object to the database
+    :param sql_query: the query to run
+    :param args: parameters of the query, if any
+    :return: a dataframe containing the query results
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(sql_query, args)
+        columns = [desc[0] for desc in cur.description]
+        return pd.DataFrame(list(cur.fetchall()), columns=columns)
+    finally:
+        cur.close()
+
+
 def verify_database(conn):
     """Check the status of the database connected by
         querying information about all tables and views within it
     :param conn: a connection object to the database
     :return: None
     """
-    df = pd.read_sql("SHOW TABLES;", con=conn)
+    df = _query_to_df(conn, "SHOW TABLES;")
     print(df)
 
 
@@ -49,17 +74,60 @@ def verify_table_index(conn, table_name):
     :param table_name: table name
     :return: None
     """
-    df = pd.read_sql(f"SHOW INDEX FROM `{table_name}`;", con=conn)
+    df = _query_to_df(conn, f"SHOW INDEX FROM `{table_name}`;")
     print(df)
 
 
-def verify_table_content(conn, table_name):
-    """Check the contents of the table specified by table_name in the database
+def verify_table_content(conn, table_name, limit=5):
+    """Check the contents of the table specified by table_name in the database.
+    Rows are streamed from a server-side cursor in chunks, so a large `limit`
+    does not make the driver buffer the whole result first.
     :param conn: a connection object to the database
     :param table_name: table name
-    :return: a dataframe containing the first 5 rows in the table
+    :param limit: the number of rows to read
+    :return: a dataframe containing the first `limit` rows in the table
+    """
+    df = read_sql_in_chunks(conn, f"SELECT * FROM `{table_name}` LIMIT %s", (limit,))
+    return df
+
+
+def _query_price_sums_per_year(
+    conn, pp_data, date, type, per_property_type, after_db_id, up_to_db_id
+):
+    """Query the sum and count of housing prices per year over the rows whose db_id
+    lies in (after_db_id, up_to_db_id]
+    :param conn: a connection to database
+    :param pp_data: db table name
+    :param date: column name for date
+    :param type: column name for property_type
+    :param per_property_type: a boolean indicating whether we group by property_type
+    :param after_db_id: only count rows with a larger db_id when not None
+    :param up_to_db_id: only count rows with a db_id up to this one when not None
+    :return: a dataframe with columns year, [type,] sum_price and cnt
     """
-    df = pd.read_sql(f"SELECT * FROM `{table_name}` LIMIT 5;", con=conn)
+    group_by = [f"EXTRACT(year FROM `{date}`)"]
+    column_names = f"EXTRACT(year FROM `{date}`) as year"
+    if per_property_type:
+        group_by.append(f"`{type}`")
+        column_names += f", `{type}` as {type}"
+    sql_query = (
+        f"SELECT {column_names}, SUM(price) as sum_price, COUNT(*) as cnt"
+        + f" FROM `{pp_data}`"
+    )
+    conditions = []
+    args = []
+    if after_db_id is not None:
+        conditions.append("`db_id` > %s")
+        args.append(after_db_id)
+    if up_to_db_id is not None:
+        conditions.append("`db_id` <= %s")
+        args.append(up_to_db_id)
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += " GROUP BY " + ", ".join(group_by)
+    df = _query_to_df(conn, sql_query, args or None)
+    df["sum_price"] = df["sum_price"].astype(float)
+    df["cnt"] = df["cnt"].astype(int)
     return df
 
 
@@ -69,29 +137,283 @@ def get_average_housing_price_per_year(
     pp_data="pp_data",
     date="date_of_transfer",
     type="property_type",
+    cache_dir=None,
+    summary=None,
 ):
-    """Query the average housing price per year
+    """Query the average housing price per year.
+    When `cache_dir` is given, the per-year sums and counts are pickled there,
+    keyed by the server, database and query, along with the largest db_id and the
+    creation time of `pp_data` they were computed from. Each call reads that
+    fingerprint first, from the primary key and information_schema without
+    scanning the table: if it is unchanged the cached sums are used, if only the
+    largest db_id grew just the rows appended since are aggregated and merged in,
+    and if the table was recreated (and so reloaded) the sums are recomputed.
+    Rows deleted or updated in place are not detected.
+    When `summary` names a table built by `PricePaidDataTable.build_yearly_summary`,
+    the averages are read from it instead and neither pp_data nor the cache is used.
     :param conn: a connection to database
     :param per_property_type: a boolean indicating whether we group by property_type
     :param pp_data: db table name
     :param date: column name for date
     :param type: column name for property_type
+    :param cache_dir: directory of the cache, or None to always query the database
+    :param summary: name of the summary table, if any
     :return: a dataframe containing the average housing price
     """
-    column_names = f" avg(price) as mean_price, EXTRACT(year FROM `{date}`) as year"
-    if per_property_type:
-        column_names += f", {type} as {type}"
-    sql_query = (
-        "SELECT"
-        + column_names
-        + f" FROM `{pp_data}` GROUP BY EXTRACT(year FROM `{date}`)"
-    )
-    if per_property_type:
-        sql_query += f" , `{type}`"
-    df = pd.read_sql(sql_query, con=conn)
+    if summary is not None:
+        column_names = "SUM(sum_price) / SUM(cnt) as mean_price, year"
+        group_by = "year"
+        if per_property_type:
+            column_names += f", property_type as {type}"
+            group_by += ", property_type"
+        df = _query_to_df(
+            conn, f"SELECT {column_names} FROM `{summary}` GROUP BY {group_by}"
+        )
+        df["mean_price"] = df["mean_price"].astype(float)
+        return df
+
+    keys = ["year", type] if per_property_type else ["year"]
+    if cache_dir is None:
+        sums = _query_price_sums_per_year(
+            conn, pp_data, date, type, per_property_type, None, None
+        )
+    else:
+        server = _query_to_df(
+            conn,
+            "SELECT @@hostname as host, @@port as port, DATABASE() as db,"
+            + f" (SELECT MAX(`db_id`) FROM `{pp_data}`) as max_db_id,"
+            + " (SELECT CREATE_TIME FROM information_schema.TABLES"
+            + " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s) as create_time",
+            (pp_data,),
+        ).iloc[0]
+        fingerprint = {
+            "create_time": str(server["create_time"]),
+            "max_db_id": int(server["max_db_id"] or 0),
+        }
+        digest = hashlib.sha1(
+            repr(
+                (
+                    server["host"],
+                    int(server["port"]),
+                    server["db"],
+                    pp_data,
+                    date,
+                    type,
+                    per_property_type,
+                )
+            ).encode()
+        ).hexdigest()
+        cache_file = os.path.join(cache_dir, f"{digest}.pkl")
+
+        sums = None
+        if os.path.exists(cache_file):
+            cached, cached_sums = pd.read_pickle(cache_file)
+            if cached == fingerprint:
+                return _mean_price_per_year(cached_sums, keys)
+            if (
+                cached["create_time"] == fingerprint["create_time"]
+                and cached["max_db_id"] < fingerprint["max_db_id"]
+            ):
+                new_sums = _query_price_sums_per_year(
+                    conn,
+                    pp_data,
+                    date,
+                    type,
+                    per_property_type,
+                    cached["max_db_id"],
+                    fingerprint["max_db_id"],
+                )
+                sums = (
+                    pd.concat([cached_sums, new_sums])
+                    .groupby(keys, as_index=False)
+                    .agg({"sum_price": "sum", "cnt": "sum"})
+                )
+        if sums is None:
+            sums = _query_price_sums_per_year(
+                conn,
+                pp_data,
+                date,
+                type,
+                per_property_type,
+                None,
+                fingerprint["max_db_id"],
+            )
+        os.makedirs(cache_dir, exist_ok=True)
+        pd.to_pickle((fingerprint, sums), cache_file)
+    return _mean_price_per_year(sums, keys)
+
+
+def _mean_price_per_year(sums, keys):
+    """Turn per-year sums and counts of prices into average prices
+    :param sums: a dataframe with the columns in keys, sum_price and cnt
+    :param keys: the grouping columns
+    :return: a dataframe with column mean_price and the columns in keys
+    """
+    df = pd.DataFrame({"mean_price": sums["sum_price"] / sums["cnt"]})
+    for key in keys:
+        df[key] = sums[key].to_numpy()
     return df
 
 
+def _poi_xy(pois):
+    """Get the centroid coordinates of POIs as arrays, reading the `_cx` and `_cy`
+    columns precomputed by `download_POI_around_coordinate` when present
+    :param pois: a geodataframe representing Points of Interest
+    :return: a tuple (xs, ys) of contiguous float64 arrays holding centroid longitudes and latitudes
+    """
+    if "_cx" in pois.columns and "_cy" in pois.columns:
+        xs = pois["_cx"].to_numpy(dtype=float)
+        ys = pois["_cy"].to_numpy(dtype=float)
+    else:
+        xs, ys = _centroid_xy(pois.geometry)
+    return np.ascontiguousarray(xs), np.ascontiguousarray(ys)
+
+
+EARTH_RADIUS_KM = 6371.0
+# km per degree of latitude, used to express the degree threshold in km
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def _haversine_km(latitude, longitude, latitudes, longitudes):
+    """Calculate great-circle distances in km, broadcasting over numpy arrays
+    :param latitude: latitude, or an array of latitudes
+    :param longitude: longitude, or an array of longitudes
+    :param latitudes: an array of latitudes
+    :param longitudes: an array of longitudes
+    :return: a numpy array of distances in km
+    """
+    lat0 = np.deg2rad(latitude)
+    lat1 = np.deg2rad(latitudes)
+    dlon = np.deg2rad(longitudes - longitude)
+    a = (
+        np.sin((lat1 - lat0) / 2) ** 2
+        + np.cos(lat0) * np.cos(lat1) * np.sin(dlon / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _unit_vectors(latitudes, longitudes):
+    """Convert coordinates to points on the unit sphere. The straight-line (chord)
+    distance between two such points grows monotonically with their great-circle
+    distance, so k-d trees over them select POIs by true distance in every direction.
+    :param latitudes: an array of latitudes
+    :param longitudes: an array of longitudes
+    :return: a numpy array of shape (n, 3)
+    """
+    lat = np.deg2rad(latitudes)
+    lon = np.deg2rad(longitudes)
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def _chord_radius(threshold):
+    """Get the unit-sphere chord length of a great-circle distance of `threshold`
+    degrees, enlarged by a hair so that the exact km comparison made on the
+    candidates, not rounding in the tree, decides POIs on the boundary
+    :param threshold: distance threshold in degrees
+    :return: a float chord length
+    """
+    return 2 * math.sin(min(math.radians(threshold), math.pi) / 2) * (1 + 1e-9)
+
+
+def _reduce_distances_numpy(latitude, longitude, xs, ys, threshold):
+    """Reduce the great-circle distances in km from the point (latitude, longitude)
+    to the POI centroids (xs, ys), keeping the POIs within `threshold` degrees of
+    arc, i.e. within threshold * KM_PER_DEGREE km in any direction
+    :param latitude: latitude
+    :param longitude: longitude
+    :param xs: a numpy array of POI centroid longitudes
+    :param ys: a numpy array of POI centroid latitudes
+    :param threshold: distance threshold in degrees
+    :return: a tuple (sum, count, shortest) of the km distances within threshold,
+        shortest is the threshold in km when no POI is within it
+    """
+    threshold_km = threshold * KM_PER_DEGREE
+    dis = _haversine_km(latitude, longitude, ys, xs)
+    dis = dis[dis <= threshold_km]
+    return dis.sum(), len(dis), np.min(dis, initial=threshold_km)
+
+
+def _reduce_distances_loop(latitude, longitude, xs, ys, threshold):
+    """The same reduction as `_reduce_distances_numpy` written as a single loop
+    over the POIs, to be compiled with numba
+    """
+    threshold_km = threshold * KM_PER_DEGREE
+    lat0 = math.radians(latitude)
+    cos_lat0 = math.cos(lat0)
+    total = 0.0
+    count = 0
+    shortest = threshold_km
+    for i in range(xs.size):
+        # the great-circle distance is at least the latitude difference
+        if abs(latitude - ys[i]) > threshold:
+            continue
+        lat1 = math.radians(ys[i])
+        a = (
+            math.sin((lat1 - lat0) / 2) ** 2
+            + cos_lat0
+            * math.cos(lat1)
+            * math.sin(math.radians(xs[i] - longitude) / 2) ** 2
+        )
+        dis = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+        if dis <= threshold_km:
+            total += dis
+            count += 1
+            if dis < shortest:
+                shortest = dis
+    return total, count, shortest
+
+
+# numba is optional: with it, the per-location helpers run a compiled loop that
+# makes one pass over the POIs without allocating temporary arrays
+if njit is not None:
+    _reduce_distances = njit(cache=True, fastmath=True)(_reduce_distances_loop)
+else:
+    _reduce_distances = _reduce_distances_numpy
+
+# k-d trees over the POI centroids on the unit sphere, keyed by id() of the POI
+# dataframe and dropped when that dataframe is garbage collected
+_poi_trees = {}
+
+
+def _poi_tree(pois):
+    """Get a k-d tree over the POI centroids as `_unit_vectors`, built once per
+    POI dataframe
+    :param pois: a geodataframe representing Points of Interest
+    :return: a tuple (tree, xs, ys) of the tree and the centroid arrays
+    """
+    key = id(pois)
+    entry = _poi_trees.get(key)
+    if entry is None:
+        xs, ys = _poi_xy(pois)
+        entry = (cKDTree(_unit_vectors(ys, xs)), xs, ys)
+        _poi_trees[key] = entry
+        weakref.finalize(pois, _poi_trees.pop, key, None)
+    return entry
+
+
+def _reduce_POI_distances(latitude, longitude, pois, threshold):
+    """Reduce the distances from the point (latitude, longitude) to the POIs
+    within threshold, as `_reduce_distances`, looking the candidates up in the
+    k-d tree of the POIs instead of scanning them all
+    :param latitude: latitude
+    :param longitude: longitude
+    :param pois: a geodataframe representing Points of Interest
+    :param threshold: distance threshold in degrees
+    :return: a tuple (sum, count, shortest) of the km distances within threshold
+    """
+    tree, xs, ys = _poi_tree(pois)
+    candidates = np.asarray(
+        tree.query_ball_point(
+            _unit_vectors([latitude], [longitude])[0], _chord_radius(threshold)
+        ),
+        dtype=np.intp,
+    )
+    return _reduce_distances(
+        latitude, longitude, xs[candidates], ys[candidates], threshold
+    )
+
+
 def get_average_distance_to_POI(latitude, longitude, pois, threshold):
     """Calculate the average distance from the point (latitude, longitude) to POIs.
     Valid distances should be less than thresdhold.
@@ -99,18 +421,10 @@ def get_average_distance_to_POI(latitude, longitude, pois, threshold):
     :param longitude: longitude
     :param pois: a geodataframe representing Points of Interest
     :param threshold: the upper limit of distance to be considered when calculating the mean
-    :return: a float value representing average distance to POIs
+    :return: a float value representing average distance to POIs in km
     """
-    total_dis = 0
-    for row in pois.iterrows():
-        polygon = row[1]["geometry"]
-        dis = math.sqrt(
-            (latitude - polygon.centroid.y) ** 2 + (longitude - polygon.centroid.x) ** 2
-        )
-        if dis > threshold:
-            continue
-        total_dis += dis
-    return total_dis / len(pois) * 111
+    total, _, _ = _reduce_POI_distances(latitude, longitude, pois, threshold)
+    return total / len(pois)
 
 
 def get_cnt_of_POI(latitude, longitude, pois, threshold):
@@ -121,16 +435,8 @@ def get_cnt_of_POI(latitude, longitude, pois, threshold):
     :param threshold: the upper limit of distance to be considered when calculating the count
     :return: an integer value representing the number of nearby POIs
     """
-    cnt = 0
-    for row in pois.iterrows():
-        polygon = row[1]["geometry"]
-        dis = math.sqrt(
-            (latitude - polygon.centroid.y) ** 2 + (longitude - polygon.centroid.x) ** 2
-        )
-        if dis > threshold:
-            continue
-        cnt += 1
-    return cnt
+    _, count, _ = _reduce_POI_distances(latitude, longitude, pois, threshold)
+    return int(count)
 
 
 def get_shortest_distance_to_POI(latitude, longitude, pois, threshold):
@@ -140,16 +446,10 @@ def get_shortest_distance_to_POI(latitude, longitude, pois, threshold):
     :param longitude: longitude
     :param pois: a geodataframe representing Points of Interest
     :param threshold: the upper limit of distance to be considered when calculating the minimum
-    :return: a float value representing shortest distance to that POI
+    :return: a float value representing shortest distance to that POI in km
     """
-    shortest_dist = threshold
-    for row in pois.iterrows():
-        polygon = row[1]["geometry"]
-        dis = math.sqrt(
-            (latitude - polygon.centroid.y) ** 2 + (longitude - polygon.centroid.x) ** 2
-        )
-        shortest_dist = min(shortest_dist, dis)
-    return shortest_dist * 111
+    _, _, shortest = _reduce_POI_distances(latitude, longitude, pois, threshold)
+    return shortest
 
 
 def create_gdf_from_df(
@@ -181,16 +481,24 @@ def sample_locations_from_bbox(
     :param n_sample: the number of required samples
     :return: a dataframe of coordinates
     """
-    latitudes = []
-    longitudes = []
-    for _ in range(n_sample):
-        i = random.uniform(latitude - box_height / 2, latitude + box_height / 2)
-        j = random.uniform(longitude - box_width / 2, longitude + box_width / 2)
-        latitudes.append(i)
-        longitudes.append(j)
+    rng = np.random.default_rng()
+    latitudes = rng.uniform(
+        latitude - box_height / 2, latitude + box_height / 2, n_sample
+    )
+    longitudes = rng.uniform(
+        longitude - box_width / 2, longitude + box_width / 2, n_sample
+    )
     return pd.DataFrame({"lattitude": latitudes, "longitude": longitudes})
 
 
+# the feature helpers that `_compute_all_features` computes in bulk
+_VECTORIZED_METHODS = {
+    get_average_distance_to_POI: "avg_dist",
+    get_cnt_of_POI: "cnt",
+    get_shortest_distance_to_POI: "shortest_dist",
+}
+
+
 def calculate_single_feature(
     df, feature_fn, dist_threshold, method_name, poi, feature_name
 ):
@@ -205,62 +513,136 @@ def calculate_single_feature(
     :return: a dataframe containing the new feature
     """
     column_name = feature_name + "_" + method_name
-    df[column_name] = df.apply(
-        lambda row: feature_fn(
-            row.lattitude.item(), row.longitude.item(), poi, dist_threshold
-        ),
-        axis=1,
-    )
+    lat_arr = df["lattitude"].to_numpy(dtype=float)
+    lon_arr = df["longitude"].to_numpy(dtype=float)
+    if feature_fn in _VECTORIZED_METHODS:
+        # known helpers are computed for all rows at once
+        xs, ys = _poi_xy(poi)
+        values = _compute_all_features(lat_arr, lon_arr, xs, ys, dist_threshold)
+        df[column_name] = values[_VECTORIZED_METHODS[feature_fn]]
+    else:
+        df[column_name] = [
+            feature_fn(lat, lon, poi, dist_threshold)
+            for lat, lon in zip(lat_arr, lon_arr)
+        ]
     return df
 
 
+def _compute_all_features(lat_arr, lon_arr, xs, ys, threshold):
+    """Compute every distance feature of one POI set for many locations at once.
+    Only location-POI pairs within `threshold` degrees of arc (threshold *
+    KM_PER_DEGREE km in any direction) are enumerated, through k-d trees over the
+    locations and the POI centroids on the unit sphere, so the cost grows with
+    the number of nearby pairs rather than with locations times POIs. Distances
+    are great-circle distances in km.
+    :param lat_arr: a numpy array of latitudes
+    :param lon_arr: a numpy array of longitudes
+    :param xs: a numpy array of POI centroid longitudes, as returned by `_poi_xy`
+    :param ys: a numpy array of POI centroid latitudes, as returned by `_poi_xy`
+    :param threshold: distance threshold
+    :return: a dict mapping method name ("avg_dist", "cnt", "shortest_dist") to a numpy array
+    """
+    n = len(lat_arr)
+    threshold_km = threshold * KM_PER_DEGREE
+    pairs = cKDTree(_unit_vectors(lat_arr, lon_arr)).sparse_distance_matrix(
+        cKDTree(_unit_vectors(ys, xs)), _chord_radius(threshold), output_type="ndarray"
+    )
+    rows = pairs["i"]
+    dis = _haversine_km(lat_arr[rows], lon_arr[rows], ys[pairs["j"]], xs[pairs["j"]])
+    within = dis <= threshold_km
+    rows = rows[within]
+    dis = dis[within]
+    shortest = np.full(n, threshold_km)
+    np.minimum.at(shortest, rows, dis)
+    return {
+        "avg_dist": np.bincount(rows, weights=dis, minlength=n) / len(xs),
+        "cnt": np.bincount(rows, minlength=n),
+        "shortest_dist": shortest,
+    }
+
+
 def calculate_features(df, features, dist_threshold, pois_map):
-    """Apply 'calculate_single_feature` to a collection of features
+    """Add a column `<feature_name>_<method_name>` to df for every method of every
+    feature, computing all methods of a feature in one pass over its POIs
     :param df: a dataframe of transactions
     :param features: a JSON encoding of features
     :param dist_threshold: distance threshold
     :param pois_map: a mapping from feature_name to POIs
     :return: a dataframe containing all computed features
     """
+    lat_arr = df["lattitude"].to_numpy(dtype=float)
+    lon_arr = df["longitude"].to_numpy(dtype=float)
     for feature_name, prop in features.items():
         for method_name in prop["methods"]:
-            if method_name == "cnt":
-                feature_fn = get_cnt_of_POI
-            elif method_name == "avg_dist":
-                feature_fn = get_average_distance_to_POI
-            elif method_name == "shortest_dist":
-                feature_fn = get_shortest_distance_to_POI
-            else:
+            if method_name not in ("cnt", "avg_dist", "shortest_dist"):
                 raise NotImplementedError
-            df = calculate_single_feature(
-                df,
-                feature_fn,
-                dist_threshold,
-                method_name,
-                pois_map[feature_name],
-                feature_name,
-            )
+        # the centroids of a POI layer are extracted once, as two flat arrays
+        xs, ys = _poi_xy(pois_map[feature_name])
+        values = _compute_all_features(lat_arr, lon_arr, xs, ys, dist_threshold)
+        for method_name in prop["methods"]:
+            df[feature_name + "_" + method_name] = values[method_name]
     return df
 
 
-def plot_geo_transactions(df):
-    """Plot house locations as specified in `df` on UK map
+def plot_geo_transactions(df, max_points=200000, hexbin=False):
+    """Plot house locations as specified in `df` on UK map, coloured by log price.
+    At most `max_points` randomly sampled transactions are drawn, or with hexbin
+    every transaction is binned into hexagons coloured by their mean log price.
     :param df: a dataframe representing house locations
+    :param max_points: the maximum number of transactions drawn as points
+    :param hexbin: a boolean, draw a hexbin map instead of a scatter plot
     :return: None
     """
     fig, ax = plt.subplots(figsize=(12, 12))
-    area = ox.geocode_to_gdf("United Kingdom")
-    area.plot(ax=ax, facecolor="lightgray")
-
-    ax.scatter(
-        df.longitude,
-        df.lattitude,
-        c=np.log(df.price.values),
-        alpha=0.005,
-    )
+    _get_area("United Kingdom").plot(ax=ax, facecolor="lightgray")
+
+    if hexbin:
+        ax.hexbin(
+            df.longitude.to_numpy(),
+            df.lattitude.to_numpy(),
+            C=np.log(df.price.to_numpy(dtype=np.float32)),
+            reduce_C_function=np.mean,
+            gridsize=200,
+            mincnt=1,
+        )
+    else:
+        if len(df) > max_points:
+            rows = np.random.default_rng(0).choice(
+                len(df), size=max_points, replace=False
+            )
+            df = df.iloc[rows]
+        ax.scatter(
+            df.longitude.to_numpy(),
+            df.lattitude.to_numpy(),
+            c=np.log(df.price.to_numpy(dtype=np.float32)),
+            alpha=0.005,
+        )
     plt.show()
 
 
+@lru_cache(maxsize=32)
+def _get_edges(north, south, east, west):
+    """Download the road network within the bbox, cached per bbox
+    :param north: northern latitude of bbox
+    :param south: southern latitude of bbox
+    :param east: eastern longitude of bbox
+    :param west: western longitude of bbox
+    :return: a geodataframe of the edges of the road network
+    """
+    graph = ox.graph_from_bbox(north, south, east, west)
+    _, edges = ox.graph_to_gdfs(graph)
+    return edges
+
+
+@lru_cache(maxsize=32)
+def _get_area(place_name):
+    """Geocode the place, cached per place name
+    :param place_name: a geo-decodable string representing place name
+    :return: a geodataframe of the area of the place
+    """
+    return ox.geocode_to_gdf(place_name)
+
+
 def plot_POI(
     latitude,
     longitude,
@@ -270,6 +652,8 @@ def plot_POI(
     pois,
     graph_name=None,
     plot_coordinate=False,
+    draw_graph=True,
+    draw_area=True,
 ):
     """Geo-plot POIs on the map for the given place specified by place_name
     :param latitude: latitude
@@ -280,17 +664,19 @@ def plot_POI(
     :param pois: a list of POIs
     :param graph_name: the name of the plot
     :param plot_coordinate: boolean value, plot the coordinate (lat, long) if true
+    :param draw_graph: boolean value, download and draw the road network if true
+    :param draw_area: boolean value, geocode and draw the area of place_name if true
     :return: None
     """
     north, south, west, east = get_bbox(latitude, longitude, box_width, box_height)
 
-    graph = ox.graph_from_bbox(north, south, east, west)
-    _, edges = ox.graph_to_gdfs(graph)
-    area = ox.geocode_to_gdf(place_name)
-
     fig, ax = plt.subplots(figsize=plot.big_figsize)
-    area.plot(ax=ax, facecolor="white")
-    edges.plot(ax=ax, linewidth=1, edgecolor="dimgray")
+    if draw_area:
+        _get_area(place_name).plot(ax=ax, facecolor="white")
+    if draw_graph:
+        _get_edges(north, south, east, west).plot(
+            ax=ax, linewidth=1, edgecolor="dimgray"
+        )
 
     ax.set_xlim([west, east])
     ax.set_ylim([south, north])
@@ -342,19 +728,30 @@ def plot_scatter_matrix_for_features(
     return df
 
 
-def pca_analysis(pure_features, num_features):
-    """Perform PCA analysis on features specified by `pure_features`
+def pca_analysis(pure_features, num_features, to_plot=True, batch_size=None):
+    """Perform PCA analysis on features specified by `pure_features`, and plot the
+    explained variance ratios if to_plot is set to True
     :param pure_features: a collection of features in a dataframe
     :param num_featuress: total number of features
-    :return: None
+    :param to_plot: a boolean indicating whether the explained variance should be plot
+    :param batch_size: when set, fit an IncrementalPCA in batches of this many rows,
+        which bounds memory for large feature matrices
+    :return: a numpy array of the explained variance ratio of each component
     """
-    scaler = StandardScaler()
-    scaler.fit(pure_features)
-    pure_features = scaler.transform(pure_features)
-
-    pca = PCA(n_components=num_features)
-    features_new = pca.fit_transform(pure_features)
+    pure_features = StandardScaler().fit_transform(pure_features)
+
+    if batch_size is not None:
+        pca = IncrementalPCA(n_components=num_features, batch_size=batch_size)
+    elif num_features < min(pure_features.shape):
+        # a randomized SVD only pays off when fewer components than the
+        # full rank are kept
+        pca = PCA(n_components=num_features, svd_solver="randomized", random_state=0)
+    else:
+        pca = PCA(n_components=num_features)
+    pca.fit(pure_features)
     exp_var_pca = pca.explained_variance_ratio_
+    if not to_plot:
+        return exp_var_pca
     cum_sum_eigenvalues = np.cumsum(exp_var_pca)
 
     fig, ax = plt.subplots(figsize=plot.big_figsize)
@@ -376,3 +773,4 @@ def pca_analysis(pure_features, num_features):
     plt.legend(loc="best")
     plt.tight_layout()
     plt.show()
+    return exp_var_pca
@@ -0,0 +1,83 @@
+"""Stand-ins for database connections that record the SQL sent to them, so the
+statements built by `fynesse.access` can be checked without a server"""
+
+import re
+
+
+def normalize_sql(sql):
+    """Collapse runs of whitespace in sql into single spaces, leaving quoted
+    strings as they are"""
+    parts = re.split(r"('(?:[^'\\]|\\.)*')", sql)
+    parts[::2] = [re.sub(r"\s+", " ", part) for part in parts[::2]]
+    return "".join(parts).strip()
+
+
+class FakeCursor:
+    """A cursor that records every statement executed on its connection and
+    raises `connection.fail_on(statement)` for the statements it matches"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, sql, args=None):
+        sql = normalize_sql(sql)
+        self.connection.statements.append((sql, args))
+        error = self.connection.fail_on(sql)
+        if error is not None:
+            raise error
+        self.rows = list(self.connection.results.get(sql, []))
+
+    def executemany(self, sql, seq_of_args):
+        for args in seq_of_args:
+            self.execute(sql, args)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def nextset(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """A connection handing out `FakeCursor`s
+    :param results: rows returned for a statement, keyed by its normalized text
+    :param fail_on: a function mapping a normalized statement to the exception
+        it raises, or None
+    """
+
+    def __init__(self, results=None, fail_on=None):
+        self.results = results or {}
+        self.fail_on = fail_on or (lambda sql: None)
+        self.statements = []
+        self.cursors = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self, *args, **kwargs):
+        self.cursors += 1
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+    def ping(self):
+        pass
+
+    def sql(self):
+        """Get the text of every statement executed so far"""
+        return [sql for sql, _ in self.statements]
@@ -0,0 +1,23 @@
+import warnings
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point, box
+
+from fynesse import access
+
+
+def test_point_only_centroids_do_not_warn():
+    geometry = gpd.GeoSeries([Point(0.1, 52.2), Point(-0.1, 51.5)], crs="EPSG:4326")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        xs, ys = access._centroid_xy(geometry)
+    np.testing.assert_array_equal(xs, [0.1, -0.1])
+    np.testing.assert_array_equal(ys, [52.2, 51.5])
+
+
+def test_centroids_of_mixed_geometries():
+    geometry = gpd.GeoSeries([box(0.0, 52.0, 0.2, 52.4), Point(-0.1, 51.5)])
+    xs, ys = access._centroid_xy(geometry)
+    np.testing.assert_allclose(xs, [0.1, -0.1])
+    np.testing.assert_allclose(ys, [52.2, 51.5])
@@ -0,0 +1,104 @@
+import os
+import tempfile
+
+import requests
+
+from fynesse import access
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, body=b"", fail_after=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), 4):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise requests.exceptions.ChunkedEncodingError("connection dropped")
+            yield self.body[start : start + 4]
+
+
+class FakeServer:
+    """A session serving one file with an ETag, honouring Range with If-Range and
+    If-None-Match, whose next transfer can be cut after `fail_after` bytes"""
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+        self.fail_after = None
+        self.requests = []
+
+    def get(self, url, stream=False, headers=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        fail_after, self.fail_after = self.fail_after, None
+        validators = {"ETag": self.etag}
+        if headers.get("If-None-Match") == self.etag:
+            return FakeResponse(304, validators)
+        if "Range" in headers and headers.get("If-Range") == self.etag:
+            start = int(headers["Range"][len("bytes=") : -1])
+            if start >= len(self.body):
+                return FakeResponse(416, validators)
+            return FakeResponse(206, validators, self.body[start:], fail_after)
+        return FakeResponse(200, validators, self.body, fail_after)
+
+
+def _file_name():
+    return os.path.join(tempfile.mkdtemp(), "pp-1995-part1.csv")
+
+
+def _read(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+def test_download_then_not_modified():
+    server = FakeServer(b"0123456789abcdefghij", '"v1"')
+    file_name = _file_name()
+    assert access.download_file(server, "url", file_name)
+    assert _read(file_name) == server.body
+    assert not access.download_file(server, "url", file_name)
+    assert server.requests[-1] == {"If-None-Match": '"v1"'}
+    assert not os.path.exists(file_name + ".part")
+
+
+def test_interrupted_download_resumes_from_the_partial_file():
+    server = FakeServer(b"0123456789abcdefghij", '"v1"')
+    server.fail_after = 8
+    file_name = _file_name()
+    assert access.download_file(server, "url", file_name)
+    assert _read(file_name) == server.body
+    assert server.requests[-1] == {"Range": "bytes=8-", "If-Range": '"v1"'}
+
+
+def test_resume_restarts_when_the_file_changed():
+    server = FakeServer(b"0123456789abcdefghij", '"v1"')
+    server.fail_after = 8
+    file_name = _file_name()
+    try:
+        access.download_file(server, "url", file_name, max_attempts=1)
+    except requests.exceptions.ChunkedEncodingError:
+        pass
+    else:
+        raise AssertionError("the dropped transfer was not reported")
+    assert _read(file_name + ".part") == server.body[:8]
+
+    # If-Range no longer matches, so the server sends the new file whole
+    server.body, server.etag = b"the new file", '"v2"'
+    assert access.download_file(server, "url", file_name)
+    assert server.requests[-1]["If-Range"] == '"v1"'
+    assert _read(file_name) == b"the new file"
+    assert not access.download_file(server, "url", file_name)
+    assert server.requests[-1] == {"If-None-Match": '"v2"'}
@@ -0,0 +1,39 @@
+from fynesse import access
+from fynesse.tests.access.fakes import FakeConnection
+
+
+def test_load_data_statement_targets_file_table_and_partition():
+    conn = FakeConnection()
+    table = access.PricePaidDataTable(conn, "pp_data")
+    table.load_pp_data_file(conn.cursor(), "pp-1995-part1.csv", "p1995")
+    assert conn.sql() == [
+        "LOAD DATA LOCAL INFILE 'pp-1995-part1.csv' INTO TABLE `pp_data`"
+        + " PARTITION (`p1995`) FIELDS TERMINATED BY ',' ENCLOSED BY '\"'"
+        + " LINES STARTING BY '' TERMINATED BY '\n';"
+    ]
+
+
+def test_load_data_statement_without_partition():
+    conn = FakeConnection()
+    table = access.PricePaidDataTable(conn, "pp_data")
+    table.load_pp_data_file(conn.cursor(), "pp-2022.csv")
+    (sql,) = conn.sql()
+    assert sql.startswith(
+        "LOAD DATA LOCAL INFILE 'pp-2022.csv' INTO TABLE `pp_data` FIELDS"
+    )
+
+
+def test_load_pp_data_loads_every_file_through_one_cursor():
+    conn = FakeConnection()
+    access.PricePaidDataTable(conn, "pp_data").load_pp_data(2020, 2022)
+    loaded = [sql.split("'")[1] for sql in conn.sql()]
+    assert loaded == [
+        "pp-2020-part1.csv",
+        "pp-2020-part2.csv",
+        "pp-2021-part1.csv",
+        "pp-2021-part2.csv",
+        "pp-2022.csv",
+    ]
+    assert all("PARTITION (`p2022`)" in sql for sql in conn.sql()[4:])
+    assert conn.cursors == 1
+    assert conn.commits == 3
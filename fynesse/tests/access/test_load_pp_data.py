@@ -0,0 +1,120 @@
+from unittest import mock
+
+from fynesse import access
+from fynesse.tests.access.fakes import FakeConnection
+
+
+def _parallel_load(sessions):
+    """Run `load_pp_data_parallel` for 1995 with `create_connection` handing out
+    the given fake sessions"""
+    table = access.PricePaidDataTable(FakeConnection(), "pp_data")
+    sessions = iter(sessions)
+    with mock.patch.object(
+        access, "create_connection", lambda *args, **kwargs: next(sessions)
+    ):
+        table.load_pp_data_parallel(
+            "user",
+            "password",
+            "host",
+            "db",
+            start_year=1995,
+            end_year=1995,
+            max_workers=2,
+        )
+    return table
+
+
+def test_parallel_load_restores_every_session():
+    sessions = [FakeConnection(), FakeConnection()]
+    _parallel_load(sessions)
+    loaded = []
+    for conn in sessions:
+        statements = conn.sql()
+        assert statements[0].startswith("SET unique_checks=0;")
+        assert statements[-1].startswith("SET unique_checks=1;")
+        assert "SET autocommit=1;" in statements[-1]
+        assert conn.closed
+        loaded += [sql for sql in statements if sql.startswith("LOAD DATA")]
+    assert len(loaded) == 2
+    assert all("PARTITION (`p1995`)" in sql for sql in loaded)
+
+
+def test_parallel_load_restores_sessions_when_a_file_fails():
+    def fail_on(sql):
+        if "pp-1995-part2.csv" in sql:
+            return RuntimeError("load failed")
+
+    sessions = [FakeConnection(fail_on=fail_on), FakeConnection(fail_on=fail_on)]
+    try:
+        _parallel_load(sessions)
+    except RuntimeError as e:
+        assert str(e) == "load failed"
+    else:
+        raise AssertionError("the failed load was not reported")
+    for conn in sessions:
+        assert conn.sql()[-1].startswith("SET unique_checks=1;")
+        assert conn.closed
+
+
+def _bulk_connection(fail_on=None):
+    """Get a fake connection whose innodb_flush_log_at_trx_commit is 1"""
+    return FakeConnection(
+        results={"SELECT @@GLOBAL.innodb_flush_log_at_trx_commit": [(1,)]},
+        fail_on=fail_on,
+    )
+
+
+def _bulk_load(conn):
+    """Run `load_pp_data` for 1995 in bulk_mode on conn"""
+    table = access.PricePaidDataTable(conn, "pp_data")
+    table.load_pp_data(start_year=1995, end_year=1995, bulk_mode=True)
+
+
+def test_bulk_load_restores_settings_global_first():
+    conn = _bulk_connection()
+    _bulk_load(conn)
+    statements = conn.sql()
+    loads = [i for i, sql in enumerate(statements) if sql.startswith("LOAD DATA")]
+    restores = statements[loads[-1] + 1 :]
+    assert restores[0] == "SET GLOBAL innodb_flush_log_at_trx_commit=1"
+    assert "SET SESSION sql_log_bin=1" in restores
+    assert "SET SESSION autocommit=1" in restores
+    assert conn.commits == 1
+    assert conn.rollbacks == 0
+
+
+def test_bulk_load_restores_only_applied_settings_when_setup_fails():
+    def fail_on(sql):
+        if sql == "SET SESSION unique_checks=0":
+            return RuntimeError("access denied")
+
+    conn = _bulk_connection(fail_on)
+    try:
+        _bulk_load(conn)
+    except RuntimeError as e:
+        assert str(e) == "access denied"
+    else:
+        raise AssertionError("the failed setup was not reported")
+    statements = conn.sql()
+    restores = statements[statements.index("SET SESSION unique_checks=0") + 1 :]
+    assert restores == [
+        "SET GLOBAL innodb_flush_log_at_trx_commit=1",
+        "SET SESSION sql_log_bin=1",
+    ]
+
+
+def test_bulk_load_rolls_back_before_restoring_when_a_load_fails():
+    def fail_on(sql):
+        if "pp-1995-part2.csv" in sql:
+            return RuntimeError("load failed")
+
+    conn = _bulk_connection(fail_on)
+    try:
+        _bulk_load(conn)
+    except RuntimeError as e:
+        assert str(e) == "load failed"
+    else:
+        raise AssertionError("the failed load was not reported")
+    assert conn.commits == 0
+    assert conn.rollbacks == 1
+    assert conn.sql()[-1] == "SET SESSION bulk_insert_buffer_size=DEFAULT"
@@ -0,0 +1,44 @@
+import tempfile
+from unittest import mock
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+from fynesse import access
+
+FEATURES = {"school": {"tags": {"amenity": ["school"]}}}
+
+
+def _download(latitude, longitude, box_width, box_height, features):
+    return {
+        name: gpd.GeoDataFrame(
+            {"name": [name]}, geometry=[Point(longitude, latitude)], crs="EPSG:4326"
+        )
+        for name in features
+    }
+
+
+def test_poi_cache_is_read_back_for_the_same_region_and_tags():
+    path = tempfile.mkdtemp()
+    with mock.patch.object(
+        access, "download_POI_for_feature_list", side_effect=_download
+    ) as download:
+        first = access.build_poi_cache(52.2, 0.12, 0.1, 0.1, FEATURES, path)
+        second = access.build_poi_cache(52.2, 0.12, 0.1, 0.1, FEATURES, path)
+    assert download.call_count == 1
+    assert second["school"].geometry.equals(first["school"].geometry)
+    assert second["school"].crs == first["school"].crs
+
+
+def test_poi_cache_is_not_shared_across_regions_or_tags():
+    path = tempfile.mkdtemp()
+    with mock.patch.object(
+        access, "download_POI_for_feature_list", side_effect=_download
+    ) as download:
+        access.build_poi_cache(52.2, 0.12, 0.1, 0.1, FEATURES, path)
+        other = access.build_poi_cache(51.5, -0.12, 0.1, 0.1, FEATURES, path)
+        access.build_poi_cache(
+            52.2, 0.12, 0.1, 0.1, {"school": {"tags": {"amenity": True}}}, path
+        )
+    assert download.call_count == 3
+    assert other["school"].geometry.iloc[0].equals(Point(-0.12, 51.5))
@@ -0,0 +1,72 @@
+from unittest import mock
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+from fynesse import access
+
+
+def test_merge_tags_combines_values_and_keeps_true():
+    merged = access._merge_tags(
+        [
+            {"amenity": "school", "shop": True},
+            {"amenity": ["college", "school"], "shop": "bakery"},
+            {"leisure": ["park"]},
+        ]
+    )
+    assert merged == {
+        "amenity": ["school", "college"],
+        "shop": True,
+        "leisure": ["park"],
+    }
+
+
+def test_merge_tags_true_wins_in_either_order():
+    assert access._merge_tags([{"shop": "bakery"}, {"shop": True}]) == {"shop": True}
+    assert access._merge_tags([{"shop": True}, {"shop": "bakery"}]) == {"shop": True}
+
+
+def _pois():
+    return gpd.GeoDataFrame(
+        {
+            "amenity": ["school", "college", None, None],
+            "shop": [None, None, "bakery", "butcher"],
+        },
+        geometry=[Point(0, 0), Point(1, 1), Point(2, 2), Point(3, 3)],
+        crs="EPSG:4326",
+    )
+
+
+def test_select_by_tags_follows_osmnx_semantics():
+    pois = _pois()
+    assert list(access._select_POI_by_tags(pois, {"shop": True}).shop) == [
+        "bakery",
+        "butcher",
+    ]
+    assert list(access._select_POI_by_tags(pois, {"amenity": "school"}).index) == [0]
+    selected = access._select_POI_by_tags(
+        pois, {"amenity": ["college"], "shop": "bakery", "leisure": True}
+    )
+    assert list(selected.index) == [1, 2]
+
+
+def test_feature_list_is_split_from_one_merged_download():
+    features = {
+        "school": {"tags": {"amenity": ["school", "college"]}},
+        "shop": {"tags": {"shop": True}},
+    }
+    with mock.patch.object(
+        access, "_download_POI_cached", return_value=_pois()
+    ) as download:
+        pois_map = access.download_POI_for_feature_list(52.2, 0.12, 0.1, 0.1, features)
+    download.assert_called_once_with(
+        52.2,
+        0.12,
+        0.1,
+        0.1,
+        access._freeze_tags({"amenity": ["school", "college"], "shop": True}),
+    )
+    assert list(pois_map["school"].index) == [0, 1]
+    assert "shop" not in pois_map["school"].columns
+    assert list(pois_map["shop"].index) == [2, 3]
+    assert "amenity" not in pois_map["shop"].columns
@@ -0,0 +1,42 @@
+from fynesse import access
+from fynesse.tests.access.fakes import FakeConnection, FakeCursor
+
+
+class FailingCreateCursor(FakeCursor):
+    """A cursor whose second result, the CREATE TABLE, reports an error"""
+
+    def nextset(self):
+        raise RuntimeError("CREATE TABLE failed")
+
+
+class FailingCreateConnection(FakeConnection):
+    def cursor(self, *args, **kwargs):
+        return FailingCreateCursor(self)
+
+
+def _raises_create_error(initialize):
+    try:
+        initialize()
+    except RuntimeError as e:
+        return str(e) == "CREATE TABLE failed"
+    return False
+
+
+def test_pp_data_schema_reports_a_failed_create():
+    table = access.PricePaidDataTable(FailingCreateConnection(), "pp_data")
+    assert _raises_create_error(table.initialize_pp_data_schema)
+
+
+def test_postcode_schema_reports_a_failed_create():
+    table = access.PostcodeData(FailingCreateConnection(), "postcode_data")
+    assert _raises_create_error(table.initialize_property_prices_schema)
+
+
+def test_pp_data_schema_has_a_partition_per_year():
+    conn = FakeConnection()
+    access.PricePaidDataTable(conn, "pp_data").initialize_pp_data_schema()
+    (sql,) = conn.sql()
+    assert sql.startswith("DROP TABLE IF EXISTS `pp_data`; CREATE TABLE")
+    for year in range(1995, 2023):
+        assert f"PARTITION p{year} VALUES LESS THAN ({year + 1})" in sql
+    assert "PARTITION pmax VALUES LESS THAN MAXVALUE" in sql
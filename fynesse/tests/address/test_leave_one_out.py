@@ -0,0 +1,67 @@
+import numpy as np
+import statsmodels.api as sm
+
+from fynesse import address
+
+
+def _design(rng, family_name, n=200):
+    X = np.column_stack([np.ones(n), rng.normal(size=n), rng.uniform(0, 2, size=n)])
+    if family_name == "gaussian":
+        y = X @ [10.0, 2.0, -1.0] + rng.normal(size=n)
+    else:
+        y = rng.poisson(np.exp(X @ [2.0, 0.3, -0.2]))
+    return address._Design(X=X, y=y, db_ids=np.arange(100, 100 + n))
+
+
+def _refit_without(design, family, i):
+    keep = np.arange(len(design.y)) != i
+    return sm.GLM(design.y[keep], design.X[keep], family=family).fit().params
+
+
+def test_one_step_update_is_exact_for_the_gaussian_glm():
+    design = _design(np.random.default_rng(0), "gaussian")
+    family = address._FAMILIES["gaussian"]
+    loo = address._LeaveOneOut(design, family)
+    for i in range(0, 200, 17):
+        np.testing.assert_allclose(
+            loo.params_without(design.db_ids[i]), _refit_without(design, family, i)
+        )
+
+
+def test_one_step_update_approximates_the_poisson_glm():
+    design = _design(np.random.default_rng(0), "poisson")
+    family = address._FAMILIES["poisson"]
+    loo = address._LeaveOneOut(design, family)
+    for i in range(0, 200, 17):
+        np.testing.assert_allclose(
+            loo.params_without(design.db_ids[i]),
+            _refit_without(design, family, i),
+            rtol=1e-3,
+        )
+        observed = design.X[i]
+        np.testing.assert_allclose(
+            loo.predict_without(design.db_ids[i], observed),
+            np.exp(observed @ _refit_without(design, family, i)),
+            rtol=1e-3,
+        )
+
+
+def test_high_leverage_rows_are_refitted():
+    # a far-out row with an off-model response, where the one-step update is off
+    design = _design(np.random.default_rng(1), "poisson")
+    design.X[0, 1] = 20.0
+    design.y[0] = round(1.5 * np.exp(design.X[0] @ [2.0, 0.3, -0.2]))
+    family = address._FAMILIES["poisson"]
+    loo = address._LeaveOneOut(design, family)
+    assert loo.hat[0] > address.LOO_MAX_LEVERAGE
+    np.testing.assert_allclose(
+        loo.params_without(design.db_ids[0]),
+        _refit_without(design, family, 0),
+        rtol=1e-6,
+    )
+
+
+def test_unknown_db_id_keeps_the_full_fit():
+    design = _design(np.random.default_rng(2), "gaussian")
+    loo = address._LeaveOneOut(design, address._FAMILIES["gaussian"])
+    np.testing.assert_array_equal(loo.params_without(-1), loo.results.params)
@@ -0,0 +1,107 @@
+import sqlite3
+import tempfile
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from fynesse import assess
+
+
+class SqlitePricePaid:
+    """A pp_data table in sqlite standing in for the MariaDB one, whose
+    `query_to_df` replaces `assess._query_to_df` and records every query"""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.create_time = "2022-01-01 00:00:00"
+        self.queries = []
+        self.conn.execute(
+            "CREATE TABLE pp_data (db_id INTEGER PRIMARY KEY, price INT,"
+            + " date_of_transfer TEXT, property_type TEXT)"
+        )
+
+    def insert(self, rows):
+        self.conn.executemany(
+            "INSERT INTO pp_data (price, date_of_transfer, property_type)"
+            + " VALUES (?, ?, ?)",
+            rows,
+        )
+
+    def query_to_df(self, conn, sql_query, args=None):
+        self.queries.append(sql_query)
+        if "information_schema" in sql_query:
+            (max_db_id,) = self.conn.execute(
+                "SELECT MAX(db_id) FROM pp_data"
+            ).fetchone()
+            return pd.DataFrame(
+                [("localhost", 3306, "main", max_db_id, self.create_time)],
+                columns=["host", "port", "db", "max_db_id", "create_time"],
+            )
+        sql_query = (
+            sql_query.replace("`", '"')
+            .replace("%s", "?")
+            .replace(
+                'EXTRACT(year FROM "date_of_transfer")',
+                "CAST(strftime('%Y', date_of_transfer) AS INT)",
+            )
+        )
+        return pd.read_sql(sql_query, self.conn, params=args)
+
+    def average(self, per_property_type, cache_dir=None):
+        with mock.patch.object(assess, "_query_to_df", self.query_to_df):
+            df = assess.get_average_housing_price_per_year(
+                None, per_property_type=per_property_type, cache_dir=cache_dir
+            )
+        keys = ["year", "property_type"] if per_property_type else ["year"]
+        return df.sort_values(keys).reset_index(drop=True)[["mean_price"] + keys]
+
+
+def _transactions(rng, n, years=(1995, 2000)):
+    return [
+        (
+            int(rng.integers(50000, 1000000)),
+            f"{rng.integers(*years)}-06-01",
+            str(rng.choice(list("DSTF"))),
+        )
+        for _ in range(n)
+    ]
+
+
+def test_cached_average_follows_appended_and_back_dated_rows():
+    rng = np.random.default_rng(0)
+    for per_property_type in (False, True):
+        table = SqlitePricePaid()
+        table.insert(_transactions(rng, 200))
+        cache_dir = tempfile.mkdtemp()
+        table.average(per_property_type, cache_dir)
+
+        # an unchanged table is answered from the fingerprint alone
+        n = len(table.queries)
+        cached = table.average(per_property_type, cache_dir)
+        assert len(table.queries) == n + 1
+        pd.testing.assert_frame_equal(cached, table.average(per_property_type))
+
+        # rows appended later, some of them dated before every cached row, are
+        # aggregated alone and merged in
+        table.insert(_transactions(rng, 30) + _transactions(rng, 5, (1990, 1991)))
+        n = len(table.queries)
+        merged = table.average(per_property_type, cache_dir)
+        assert "`db_id` > %s" in table.queries[n + 1]
+        pd.testing.assert_frame_equal(merged, table.average(per_property_type))
+
+
+def test_cached_average_is_recomputed_after_a_reload():
+    rng = np.random.default_rng(1)
+    table = SqlitePricePaid()
+    table.insert(_transactions(rng, 200))
+    cache_dir = tempfile.mkdtemp()
+    table.average(False, cache_dir)
+
+    table.conn.execute("DELETE FROM pp_data")
+    table.insert(_transactions(rng, 200))
+    table.create_time = "2022-02-01 00:00:00"
+    n = len(table.queries)
+    reloaded = table.average(False, cache_dir)
+    assert "`db_id` > %s" not in table.queries[n + 1]
+    pd.testing.assert_frame_equal(reloaded, table.average(False))
@@ -0,0 +1,108 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+from fynesse import assess
+
+THRESHOLD = 0.02
+
+
+def _pois(rng, n=3000):
+    return gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(
+            rng.uniform(-0.2, 0.2, n), 51.5 + rng.uniform(-0.2, 0.2, n)
+        ),
+        crs="EPSG:4326",
+    )
+
+
+def _brute_force(latitude, longitude, pois, threshold):
+    """The features computed from every great-circle distance, without trees"""
+    dis = assess._haversine_km(
+        latitude, longitude, pois.geometry.y.to_numpy(), pois.geometry.x.to_numpy()
+    )
+    dis = dis[dis <= threshold * assess.KM_PER_DEGREE]
+    return (
+        dis.sum() / len(pois),
+        len(dis),
+        np.min(dis, initial=threshold * assess.KM_PER_DEGREE),
+    )
+
+
+def test_haversine_matches_known_distances():
+    radius = assess.EARTH_RADIUS_KM
+    np.testing.assert_allclose(
+        assess._haversine_km(51.0, 0.0, 52.0, 0.0), assess.KM_PER_DEGREE
+    )
+    np.testing.assert_allclose(
+        assess._haversine_km(0.0, 0.0, 0.0, 90.0), radius * np.pi / 2
+    )
+    # over the pole, 30 degrees of arc on either side
+    np.testing.assert_allclose(
+        assess._haversine_km(60.0, 0.0, 60.0, 180.0), radius * np.pi / 3
+    )
+
+
+def test_pois_are_selected_by_distance_in_every_direction():
+    # 0.012 degrees east at 51.5N is closer than 0.009 degrees north
+    pois = gpd.GeoDataFrame(geometry=[Point(0.012, 51.5)], crs="EPSG:4326")
+    assert assess.get_cnt_of_POI(51.5, 0.0, pois, 0.01) == 1
+    np.testing.assert_allclose(
+        assess.get_shortest_distance_to_POI(51.5, 0.0, pois, 0.01), 0.8306, atol=1e-4
+    )
+    far = gpd.GeoDataFrame(geometry=[Point(0.0, 51.511)], crs="EPSG:4326")
+    assert assess.get_cnt_of_POI(51.5, 0.0, far, 0.01) == 0
+
+
+def test_per_location_features_match_brute_force():
+    rng = np.random.default_rng(0)
+    pois = _pois(rng)
+    for latitude, longitude in zip(
+        51.5 + rng.uniform(-0.15, 0.15, 50), rng.uniform(-0.15, 0.15, 50)
+    ):
+        average, count, shortest = _brute_force(latitude, longitude, pois, THRESHOLD)
+        assert assess.get_cnt_of_POI(latitude, longitude, pois, THRESHOLD) == count
+        np.testing.assert_allclose(
+            assess.get_average_distance_to_POI(latitude, longitude, pois, THRESHOLD),
+            average,
+        )
+        np.testing.assert_allclose(
+            assess.get_shortest_distance_to_POI(latitude, longitude, pois, THRESHOLD),
+            shortest,
+        )
+
+
+def test_bulk_features_match_brute_force():
+    rng = np.random.default_rng(1)
+    pois = _pois(rng)
+    df = pd.DataFrame(
+        {
+            "lattitude": 51.5 + rng.uniform(-0.15, 0.15, 200),
+            "longitude": rng.uniform(-0.15, 0.15, 200),
+        }
+    )
+    features = {"poi": {"methods": ["cnt", "avg_dist", "shortest_dist"]}}
+    df = assess.calculate_features(df, features, THRESHOLD, {"poi": pois})
+    expected = np.array(
+        [
+            _brute_force(latitude, longitude, pois, THRESHOLD)
+            for latitude, longitude in zip(df.lattitude, df.longitude)
+        ]
+    )
+    np.testing.assert_allclose(df.poi_avg_dist, expected[:, 0])
+    np.testing.assert_array_equal(df.poi_cnt, expected[:, 1])
+    np.testing.assert_allclose(df.poi_shortest_dist, expected[:, 2])
+    assert df.poi_cnt.sum() > 0
+
+
+def test_loop_reduction_matches_numpy_reduction():
+    rng = np.random.default_rng(2)
+    xs, ys = assess._poi_xy(_pois(rng))
+    for latitude, longitude in zip(
+        51.5 + rng.uniform(-0.15, 0.15, 50), rng.uniform(-0.15, 0.15, 50)
+    ):
+        np.testing.assert_allclose(
+            assess._reduce_distances_loop(latitude, longitude, xs, ys, THRESHOLD),
+            assess._reduce_distances_numpy(latitude, longitude, xs, ys, THRESHOLD),
+        )